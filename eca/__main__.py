@@ -1,73 +1,143 @@
 #!/usr/bin/env python3
-from collections import defaultdict
+import argparse
+from contextlib import nullcontext
+from datetime import timedelta
+from eca.cache import EventCache
 import eca.config
-from eca.timestamp import TimestampDB
+from eca.analysis import collect_group_incidents, count_groups
+from eca.follow import follow_sources
+from eca.metrics import report_metrics
+from eca.server import AnalysisServer, DEFAULT_PORT, serve_http, serve_unix
+from eca.stats import Stages, print_stats, profiled
+from eca.streaming import stream_sources
+from eca.output import WRITERS, write_groups
+from eca.sweep import print_table, sweep_groups, sweep_results
 import logging
-import sys
-
-def escape(s):
-    ret = ""
-    for c in s:
-        if c.isprintable():
-            ret += c
-        elif c <= '\xff':
-            ret += r'\x{0:02x}'.format(ord(c))
+
+def positive_int(value: str) -> int:
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return n
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog="eca", description="Find texts in logs that coincide with incident events.")
+    modes = parser.add_mutually_exclusive_group()
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes used for reading sources, default 1")
+    modes.add_argument("--streaming", action="store_true",
+                       help="merge all time sorted sources in a single pass with a sliding incident window")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="seconds of out of order lines to reorder in streaming and follow mode, older lines are dropped")
+    modes.add_argument("--follow", action="store_true",
+                       help="keep reading what is appended to the sources and print the report as it changes")
+    parser.add_argument("--interval", type=float, default=60.0,
+                        help="seconds between reports in follow mode, default 60")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the event cache configured by cache-dir")
+    modes.add_argument("--sweep", action="store_true",
+                       help="read the sources once and report the matches for every combination of --ranges, "
+                            "--percentiles and --accuracies")
+    parser.add_argument("--ranges", help="comma separated ranges for --sweep, like 1s,2s,5s, default range of config")
+    parser.add_argument("--percentiles", help="comma separated percentiles for --sweep, default percentile of config")
+    parser.add_argument("--accuracies", help="comma separated accuracies for --sweep, default accuracy of config")
+    parser.add_argument("--format", choices=("table", "json", "jsonl", "csv"), default="table",
+                        help="output format of the matched texts, table is the text report or the table of --sweep, "
+                             "jsonl and csv have a row per match")
+    parser.add_argument("--top", type=positive_int, metavar="N", help="only report the N matched texts with most hits")
+    modes.add_argument("--serve", action="store_true",
+                       help="keep the parsed sources in memory and answer queries on --socket or --port")
+    parser.add_argument("--socket", metavar="PATH", help="Unix socket for --serve, one JSON query per line")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"localhost HTTP port for --serve when no --socket is given, default {DEFAULT_PORT}")
+    parser.add_argument("--stats", action="store_true",
+                        help="print lines, bytes, parse misses and timings per source and stage to stderr")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="profile the analysis with cProfile and write the statistics to FILE, the top "
+                             "entries are printed with --stats")
+    parser.add_argument("config", help="yaml config file")
+
+    return parser.parse_args()
+
+def sweep(config: eca.config.Config, args, cache: EventCache, stages: Stages) -> None:
+    ranges = [eca.config.parse_range(r) for r in args.ranges.split(',')] if args.ranges else [config.range]
+    percentiles = [int(p) for p in args.percentiles.split(',')] if args.percentiles else [config.percentile]
+    accuracies = [int(a) for a in args.accuracies.split(',')] if args.accuracies else [config.accuracy]
+    with stages.stage("sweep"):
+        incidents, sweeps = sweep_groups(config, ranges, cache)
+    with stages.stage("report"):
+        results = sweep_results(incidents, sweeps, percentiles, accuracies, args.top)
+        if args.format == "table":
+            print_table(results)
         else:
-            ret += c.encode('unicode_escape').decode('ascii')
-    return ret
+            WRITERS[args.format](results)
+
+def stream(config: eca.config.Config, args, stages: Stages) -> None:
+    with stages.stage("stream"):
+        analyses, dropped = stream_sources(config, timedelta(seconds=args.tolerance))
+    if dropped:
+        logging.warning(f"{dropped} out of order lines dropped, consider a larger --tolerance")
+    with stages.stage("report"):
+        write_groups(config, {key: analysis.incidents for key, analysis in analyses.items()},
+                     {key: analysis.counters for key, analysis in analyses.items()}, args.format, args.top)
+
+def analyze(config: eca.config.Config, args, cache: EventCache, stages: Stages) -> None:
+    with stages.stage("incidents"):
+        groups = collect_group_incidents(config, cache)
+
+    # Collect all texts and if they are applicable order into either within or outside
+    # event timestamps, separately for each incident group.
+    with stages.stage("count"):
+        counters = count_groups(config, groups, args.jobs, cache)
+
+    with stages.stage("report"):
+        write_groups(config, {key: len(timestamps) for key, timestamps in groups.items()}, counters,
+                     args.format, args.top)
+        if args.format == "table":
+            report_metrics(config, groups)
+
+def warn_ignored_metrics(config: eca.config.Config, args) -> None:
+    """Warn that metric sources are only reported after the text report of a batch run."""
+    mode = next((f"--{name}" for name in ("streaming", "follow", "sweep", "serve") if getattr(args, name)), None)
+    if mode is None and args.format != "table":
+        mode = f"--format {args.format}"
+    if mode is not None and next(config.metric_sources(), None) is not None:
+        logging.warning(f"metric-values sources are ignored with {mode}, they are only reported after the text report")
 
 def main():
-    if len(sys.argv) != 2:
-        raise RuntimeError("Usage: eca <yaml-config-file>")
-    config = eca.config.Config(sys.argv[1])
+    args = parse_arguments()
+    config = eca.config.Config(args.config)
 
     logging.basicConfig(level=logging.WARNING)
+    warn_ignored_metrics(config, args)
 
-    # Collect all incident timestamps.
-    timestamps: TimestampDB = TimestampDB(range=config.range)
-    for es in config.event_sources(master=True):
-        for ts, line in es.get_events():
-            timestamps.append(ts)
+    cache = None
+    if config.cache_dir and not args.no_cache and not (args.follow or args.streaming):
+        cache = EventCache(config.cache_dir, config.cache_max_size)
 
-    # Collect all texts and if they are applicable order into either within or outside
-    # event timestamps.
-    texts_within = defaultdict(int)  # Counters for number of times a text appears in the zone
-    texts_outside = defaultdict(int)  # Counters for number of times a text appears outside the zone
-    texts_not_applicable = defaultdict(int)
-    for es in config.event_sources(master=False):
-        for ts, line in es.get_events():
-            logging.debug(f"before normalize: {line}")
-            line = es.normalize(line)
-            logging.debug(f"after normalize: {line}")
-            if timestamps.is_applicable(ts):
-                if timestamps.in_range(ts):
-                    texts_within[line] += 1
-                    logging.debug(f"inside:  {ts} - {line[:80]}")
-                else:
-                    texts_outside[line] += 1
-                    logging.debug(f"outside: {ts} - {line[:80]}")
-            else:
-                texts_not_applicable[line] += 1
-
-    # Find texts that only occur close to incident events but not otherwise and has at least
-    # percentile percent number of hits from total incident events.
-    min_count = int((len(timestamps) * config.percentile) / 100)
-    logging.info(f"min_count:{min_count}")
-    print("Normalized texts occurring during incident event zone that matches accuracy and percentile settings:")
-    print("---------------------------------------------------------------------------------------------------")
-    for txt, count in sorted(texts_within.items(), key=lambda x: x[1], reverse=True):
-        printable = escape(txt)
-        total_occurrences = texts_outside[txt] + count
-        logging.info(f"{printable[20:60]} : total_occurrences:{total_occurrences} count:{count}")
-
-        if int((count * 100) / total_occurrences) >= config.accuracy and count >= min_count:
-            print(f"within zone:{count} occurrences, out of zone: {texts_outside[txt]}:\n{printable}\n")
-    print("---------------------------------------------------------------------------------------------------")
-
-    print(f"Total {len(timestamps)} incidents, "
-          f"{len(texts_within)} texts found within event range, "
-          f"{len(texts_outside)} outside. "
-          f"{len(texts_not_applicable)} not applicable.")
+    if args.serve:
+        server = AnalysisServer(config, cache)
+        if args.socket:
+            serve_unix(server, args.socket)
+        else:
+            serve_http(server, args.port)
+        return
+
+    stages = Stages()
+    with profiled(args.profile) if args.profile else nullcontext() as profile:
+        if args.follow:
+            # Returns with the final report on Ctrl-C, the statistics follow it.
+            with stages.stage("follow"):
+                follow_sources(config, interval=args.interval, tolerance=timedelta(seconds=args.tolerance),
+                               format=args.format, top=args.top)
+        elif args.streaming:
+            stream(config, args, stages)
+        elif args.sweep:
+            sweep(config, args, cache, stages)
+        else:
+            analyze(config, args, cache, stages)
+
+    if args.stats:
+        print_stats(list(config.event_sources()), stages, profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""Reading, classification, counting and reporting of event sources."""
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from eca.cache import CachedEvents, EventCache
+from eca.cluster import cluster_texts
+import eca.config
+from eca.counters import TextCounters
+from eca.sources import TextEvents
+from eca.stats import SourceStats, measured_peak
+from functools import lru_cache
+from itertools import islice, repeat
+from eca.timestamp import TimestampDB, NOT_APPLICABLE, OUTSIDE, WITHIN
+import logging
+import math
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Number of events classified together against the incident database.
+CHUNK_SIZE = 65536
+
+# Smallest part of a file handed to a worker process when running parallel jobs.
+SPLIT_SIZE = 16 * 1024 * 1024
+
+# Size of the blocks that are sampled between incident zones.
+SAMPLE_BLOCK_SIZE = 64 * 1024
+
+def chunks(iterable, size):
+    """Split iterable into lists of at most size items."""
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+class _Escapes(dict):
+    """Translation table of str.translate() that escapes non printable characters, filled as they are met."""
+    def __missing__(self, code):
+        c = chr(code)
+        if c.isprintable():
+            escaped = c
+        elif code <= 0xff:
+            escaped = r'\x{0:02x}'.format(code)
+        else:
+            escaped = c.encode('unicode_escape').decode('ascii')
+        self[code] = escaped
+        return escaped
+
+
+_ESCAPES = _Escapes()
+
+def escape(s):
+    """Return s with non printable characters escaped as in Python string literals."""
+    return s if s.isprintable() else s.translate(_ESCAPES)
+
+def incident_times(es: TextEvents, cache: EventCache = None) -> Iterable[int]:
+    """Return the timestamps of a master source, from the cache if there is one."""
+    if cache is not None:
+        return cache.load(es).timestamps
+    return (ts for ts, line in es.get_events())
+
+def collect_group_incidents(config: eca.config.Config,
+                            cache: EventCache = None) -> Dict[Tuple[str, str], TimestampDB]:
+    """
+    Collect the incident timestamps of every incident group of every category, keyed by (category, group).
+
+    Master sources with the same group in a category share a group, those without a group are in group None
+    of their categories. A category without master sources only has group None, without incidents. Without
+    any groups there is a group per category with all incidents of its master sources.
+    """
+    groups = {key: TimestampDB(range=config.range) for key in group_keys(config)}
+    for es in config.event_sources(master=True):
+        for ts in incident_times(es, cache):
+            for category in es.categories:
+                groups[(category, es.group)].append(ts)
+    return groups
+
+def group_keys(config: eca.config.Config) -> List[Tuple[str, str]]:
+    """Return the (category, group) keys of the incident groups of config, see collect_group_incidents()."""
+    masters = list(config.event_sources(master=True))
+    keys = list()
+    for category in config.categories:
+        names = [es.group for es in masters if category in es.categories] or [None]
+        keys.extend((category, name) for name in dict.fromkeys(names))
+    return keys
+
+def group_title(groups: Dict[Tuple[str, str], object], key: Tuple[str, str]) -> str:
+    """Return the title of the (category, group) key among the keys of groups, or None when there is a single group."""
+    if len(groups) == 1:
+        return None
+    category, name = key
+    parts = list()
+    if len({c for c, _ in groups}) > 1:
+        parts.append(f"category {category}")
+    if name is not None:
+        parts.append(f"incident group {name}")
+    elif sum(c == category for c, _ in groups) > 1:
+        parts.append("incidents without group")
+    title = ", ".join(parts)
+    return title[:1].upper() + title[1:]
+
+def _count_range(es: TextEvents, targets: List[Tuple[TimestampDB, TextCounters]], start: int, end: int,
+                 periods: List[List[Tuple[int, int]]] = None) -> None:
+    """
+    Count the lines from start to end into the counters of every target, parsing and normalizing them once.
+
+    With periods, a sorted list of (start, end) times per target, a target only counts the lines with a
+    timestamp in one of its periods.
+    """
+    if not es.use_mmap:
+        events = es.get_events(start, end)
+    elif len(targets) == 1:
+        events = es.scan_events(targets[0][0].is_applicable, start, end)
+    else:
+        events = es.scan_events(lambda ts: any(db.is_applicable(ts) for db, _ in targets), start, end)
+    # Debug logging is checked once, formatting messages per line costs more than the counting itself.
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    for chunk in chunks(events, CHUNK_SIZE):
+        times = [ts for ts, _ in chunk]
+        started = time.perf_counter()
+        texts = _normalize_chunk(es, chunk, debug)
+        normalized = time.perf_counter()
+        es.stats.normalize_seconds += normalized - started
+        if len(targets) == 1:
+            _count_target(*targets[0], times, texts, debug)
+        else:
+            _count_targets(targets, times, texts, debug, periods)
+        es.stats.classify_seconds += time.perf_counter() - normalized
+
+def _normalize_chunk(es: TextEvents, chunk: List[Tuple[int, str]], debug: bool) -> List[str]:
+    """Return the normalized texts of the events, None for those without text."""
+    texts = list()
+    for ts, line in chunk:
+        if line is not None:
+            if debug:
+                logging.debug(f"before normalize: {line}")
+            line = es.normalize(line)
+            if debug:
+                logging.debug(f"after normalize: {line}")
+        texts.append(line)
+    return texts
+
+def _count_target(timestamps: TimestampDB, counters: TextCounters, times: List[int], texts: List[str],
+                  debug: bool) -> None:
+    columns = counters.columns
+    for ts, text, zone in zip(times, texts, timestamps.classify_many(times)):
+        if text is None:
+            counters.skipped += 1
+            continue
+        columns[zone][counters.intern(text)] += 1
+        if debug:
+            logging.debug(f"{'inside: ' if zone == WITHIN else 'outside:' if zone == OUTSIDE else 'n/a:    '} "
+                          f"{ts} - {text[:80]}")
+
+def _count_targets(targets: List[Tuple[TimestampDB, TextCounters]], times: List[int], texts: List[str],
+                   debug: bool, periods: List[List[Tuple[int, int]]] = None) -> None:
+    within, applicable = _zone_masks([timestamps for timestamps, _ in targets], times)
+    counted = _period_masks(periods, times) if periods is not None else repeat(-1, len(times))
+    if debug:
+        for ts, text, w, a in zip(times, texts, within, applicable):
+            logging.debug(f"within {w:b}, applicable {a:b}: {ts} - {(text or '')[:80]}")
+    # Events are counted per distinct text and masks, which are far fewer than the events, before the counts
+    # are spread over the targets.
+    for (text, w, a, c), count in Counter(zip(texts, within, applicable, counted)).items():
+        for bit, (_, counters) in enumerate(targets):
+            if not c >> bit & 1:
+                continue
+            if text is None:
+                counters.skipped += count
+                continue
+            zone = WITHIN if w >> bit & 1 else OUTSIDE if a >> bit & 1 else NOT_APPLICABLE
+            counters.columns[zone][counters.intern(text)] += count
+
+def _zone_masks(databases: List[TimestampDB], times: List[int]) -> Tuple[List[int], List[int]]:
+    """
+    Return for every timestamp a bitmask of the databases it is within the zones of and a bitmask of those
+    it is applicable to, where bit i stands for databases[i].
+    """
+    if np is not None and len(databases) < 63:
+        within = np.zeros(len(times), dtype=np.int64)
+        applicable = np.zeros(len(times), dtype=np.int64)
+        for bit, timestamps in enumerate(databases):
+            zones = timestamps.classify_array(times)
+            within |= (zones == WITHIN).astype(np.int64) << bit
+            applicable |= (zones != NOT_APPLICABLE).astype(np.int64) << bit
+        return within.tolist(), applicable.tolist()
+
+    within, applicable = [0] * len(times), [0] * len(times)
+    for bit, timestamps in enumerate(databases):
+        flag = 1 << bit
+        for k, zone in enumerate(timestamps.classify_many(times)):
+            if zone != NOT_APPLICABLE:
+                applicable[k] |= flag
+                if zone == WITHIN:
+                    within[k] |= flag
+    return within, applicable
+
+def _period_masks(periods: List[List[Tuple[int, int]]], times: List[int]) -> List[int]:
+    """Return for every timestamp a bitmask of the period lists it is in, where bit i stands for periods[i]."""
+    if np is not None and len(periods) < 63:
+        ts = np.asarray(times, dtype=np.int64)
+        masks = np.zeros(len(times), dtype=np.int64)
+        for bit, target_periods in enumerate(periods):
+            starts = np.array([start for start, _ in target_periods], dtype=np.int64)
+            ends = np.array([end for _, end in target_periods], dtype=np.int64)
+            i = np.searchsorted(starts, ts, side='right') - 1
+            inside = (i >= 0) & (ts < ends[np.maximum(i, 0)]) if len(starts) else np.zeros(len(ts), dtype=bool)
+            masks |= inside.astype(np.int64) << bit
+        return masks.tolist()
+
+    masks = [0] * len(times)
+    for bit, target_periods in enumerate(periods):
+        starts = [start for start, _ in target_periods]
+        for k, ts in enumerate(times):
+            i = bisect_right(starts, ts) - 1
+            if i >= 0 and ts < target_periods[i][1]:
+                masks[k] |= 1 << bit
+    return masks
+
+def _sample_range(es: TextEvents, counters: TextCounters, start: int, end: int, rate: float) -> None:
+    """
+    Estimate the outside counts of the lines from start to end, which all are between incident zones, from
+    a simple random sample of rate of its blocks.
+
+    The count of a text is estimated as the number of blocks times its mean count per sampled block, and
+    the variance from the spread of its counts over the sampled blocks.
+    """
+    blocks = es.byte_ranges(SAMPLE_BLOCK_SIZE, start, end)
+    n, total = min(len(blocks), max(2, math.ceil(rate * len(blocks)))), len(blocks)
+    sums = dict()
+    for block_start, block_end in random.Random(f"{es.filename}:{start}").sample(blocks, n):
+        block = dict()
+        for ts, line in es.get_events(block_start, block_end):
+            i = counters.intern(es.normalize(line))
+            block[i] = block.get(i, 0) + 1
+        for i, count in block.items():
+            s, s2 = sums.get(i, (0, 0))
+            sums[i] = (s + count, s2 + count * count)
+
+    outside = counters.columns[OUTSIDE]
+    for i, (s, s2) in sums.items():
+        outside[i] += round(total * s / n)
+        if n < total:
+            spread = (s2 - s * s / n) / (n - 1)
+            counters.variance[i] = counters.variance.get(i, 0.0) + total * total * (1 - n / total) * spread / n
+
+def _plan_periods(timestamps: TimestampDB, seek: Callable[[int], int],
+                  sample_rate: float) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+    """
+    Return the periods, as (start, end) times, of a time sorted source that are read in full and the periods
+    between incident zones that are sampled. The lines of a period are those from seek(start) to seek(end).
+
+    Lines before and after the applicable period are never read. Without sample_rate the applicable period
+    is read in full.
+    """
+    zones = timestamps.zones()
+    if not zones:
+        return [], []
+    if not sample_rate:
+        return [(zones[0][0], zones[-1][1])], []
+
+    exact, sampled = list(), list()
+    for i, zone in enumerate(zones):
+        exact.append(zone)
+        if i + 1 < len(zones):
+            gap = (zone[1], zones[i + 1][0])
+            # Gaps smaller than a block are cheap enough to read in full.
+            (sampled if seek(gap[1]) - seek(gap[0]) > SAMPLE_BLOCK_SIZE else exact).append(gap)
+    return _merge_periods(exact), sampled
+
+def _merge_periods(periods: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Return sorted periods with those that overlap or touch merged."""
+    merged = list()
+    for start, end in sorted(periods):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _count_sorted(es: TextEvents, partitions: Dict[str, TimestampDB], results: Dict[str, TextCounters],
+                  start: int, end: int, sample_rate: float) -> None:
+    """
+    Count a time sorted source against every partition in one pass over the union of the periods that the
+    partitions read in full, where each partition only counts the lines in its own periods. The gaps between
+    incident zones that are sampled are sampled per partition.
+    """
+    if end is None:
+        end = os.path.getsize(es.filename)
+    seek = lru_cache(maxsize=None)(es.seek)
+
+    def clip(periods):
+        ranges = [(max(seek(s), start), min(seek(e), end)) for s, e in periods]
+        return [(s, e) for s, e in ranges if s < e]
+
+    plans = {key: _plan_periods(timestamps, seek, sample_rate) for key, timestamps in partitions.items()}
+    exact = _merge_periods(clip(period for periods, _ in plans.values() for period in periods))
+    sampled = {key: clip(plan[1]) for key, plan in plans.items()}
+    logging.info(f"{es.filename}: reading {sum(e - s for s, e in exact)} bytes, "
+                 f"sampling {sum(e - s for ranges in sampled.values() for s, e in ranges)} bytes of {end - start}")
+    targets = [(partitions[key], results[key]) for key in partitions]
+    periods = [plans[key][0] for key in partitions] if len(partitions) > 1 else None
+    for range_start, range_end in exact:
+        _count_range(es, targets, range_start, range_end, periods)
+    for key, ranges in sampled.items():
+        for range_start, range_end in ranges:
+            _sample_range(es, results[key], range_start, range_end, sample_rate)
+
+def count_partitions(es: TextEvents, partitions: Dict[str, TimestampDB], start: int = 0, end: int = None,
+                     sample_rate: float = None) -> Dict[str, TextCounters]:
+    """
+    Count the texts of a source, or a byte range of it, against the incident database of every partition.
+
+    Each line is parsed and normalized once and then classified against all partitions. Time sorted sources
+    are only read in the applicable periods of the partitions, see _count_sorted().
+    """
+    results = {key: TextCounters() for key in partitions}
+    if es.time_sorted:
+        _count_sorted(es, partitions, results, start, end, sample_rate)
+    else:
+        _count_range(es, [(partitions[key], results[key]) for key in partitions], start, end)
+
+    info = es.normalizer_cache_info()
+    if info and info.hits + info.misses:
+        logging.info(f"{es.filename}: normalizer cache hit rate {100 * info.hits / (info.hits + info.misses):.1f}%")
+    return results
+
+def count_cached(cached: CachedEvents, timestamps: TimestampDB) -> TextCounters:
+    """
+    Count cached events of a source, which are already parsed and normalized.
+
+    With NumPy all events are classified at once and counted per text id with bincount().
+    """
+    if np is not None and len(cached):
+        zones = timestamps.classify_array(np.frombuffer(cached.timestamps, dtype=np.int64))
+        ids = np.frombuffer(cached.ids, dtype=np.int32)
+        columns = tuple(array('q', np.bincount(ids[zones == zone], minlength=len(cached.texts))
+                              .astype(np.int64).tobytes()) for zone in (NOT_APPLICABLE, OUTSIDE, WITHIN))
+        return TextCounters.from_columns(list(cached.texts), columns)
+    counters = TextCounters()
+    columns = counters.columns
+    ids = [counters.intern(text) for text in cached.texts]
+    for start in range(0, len(cached), CHUNK_SIZE):
+        zones = timestamps.classify_many(cached.timestamps[start:start + CHUNK_SIZE])
+        for zone, i in zip(zones, cached.ids[start:start + CHUNK_SIZE]):
+            columns[zone][ids[i]] += 1
+    return counters
+
+def _count_cached_partitions(cached: CachedEvents, partitions: Dict[str, TimestampDB]) -> Dict[str, TextCounters]:
+    return {key: count_cached(cached, timestamps) for key, timestamps in partitions.items()}
+
+
+_worker_partitions: Dict[str, TimestampDB] = None
+
+def _init_worker(partitions: Dict[str, TimestampDB]) -> None:
+    global _worker_partitions
+    _worker_partitions = partitions
+
+def _worker_stats(es: TextEvents, parser_hits: Dict[str, int]) -> SourceStats:
+    """Return the statistics of the work done on es in this worker, parser_hits being those before it."""
+    stats = es.stats
+    stats.parsers = {name: hits - parser_hits.get(name, 0) for name, hits in es.parser_hits().items()}
+    return stats
+
+def _count_texts_in_worker(es: TextEvents, keys: List[str], start: int, end: int,
+                           sample_rate: float) -> Tuple[Dict[str, TextCounters], SourceStats]:
+    # The source arrives with the counters of the main process, only those of this worker are sent back.
+    es.stats, parser_hits = SourceStats(), es.parser_hits()
+    with measured_peak(es.stats):
+        counters = count_partitions(es, {key: _worker_partitions[key] for key in keys}, start, end, sample_rate)
+    return counters, _worker_stats(es, parser_hits)
+
+def _count_cached_in_worker(es: TextEvents, keys: List[str],
+                            cache: EventCache) -> Tuple[Dict[str, TextCounters], SourceStats]:
+    es.stats, parser_hits = SourceStats(), es.parser_hits()
+    with measured_peak(es.stats):
+        counters = _count_cached_partitions(cache.load(es), {key: _worker_partitions[key] for key in keys})
+    return counters, _worker_stats(es, parser_hits)
+
+def _count_serially(config: eca.config.Config, partitions: Dict[str, TimestampDB],
+                    sources: List[Tuple[TextEvents, List[str]]], cache: EventCache) -> List[Dict[str, TextCounters]]:
+    parts = list()
+    for es, keys in sources:
+        with measured_peak(es.stats):
+            if cache is not None:
+                parts.append(_count_cached_partitions(cache.load(es), {key: partitions[key] for key in keys}))
+            else:
+                parts.append(count_partitions(es, {key: partitions[key] for key in keys},
+                                              sample_rate=config.sample_rate))
+    return parts
+
+def _count_in_workers(config: eca.config.Config, partitions: Dict[str, TimestampDB],
+                      sources: List[Tuple[TextEvents, List[str]]], jobs: int,
+                      cache: EventCache) -> List[Dict[str, TextCounters]]:
+    """Count the sources, split into byte ranges, in a pool of jobs worker processes."""
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(partitions,)) as executor:
+        futures = list()
+        for es, keys in sources:
+            if cache is not None:
+                futures.append((es, executor.submit(_count_cached_in_worker, es, keys, cache)))
+                continue
+            size = max(SPLIT_SIZE, -(-os.path.getsize(es.filename) // jobs))
+            for start, end in es.byte_ranges(size):
+                futures.append((es, executor.submit(_count_texts_in_worker, es, keys, start, end, config.sample_rate)))
+        parts = list()
+        for es, future in futures:
+            counters, stats = future.result()
+            es.stats.merge(stats)
+            parts.append(counters)
+    return parts
+
+def _count_sources(config: eca.config.Config, partitions: Dict[str, TimestampDB],
+                   sources: List[Tuple[TextEvents, List[str]]], jobs: int, cache: EventCache) -> Dict[str, TextCounters]:
+    """Count every source against the partitions given with it and merge the counters per partition."""
+    if jobs <= 1:
+        parts = _count_serially(config, partitions, sources, cache)
+    else:
+        parts = _count_in_workers(config, partitions, sources, jobs, cache)
+
+    totals = dict()
+    for part in parts:
+        for key, counters in part.items():
+            if key in totals:
+                totals[key].merge(counters)
+            else:
+                totals[key] = counters
+    return {key: totals.get(key, TextCounters()) for key in partitions}
+
+def count_groups(config: eca.config.Config, groups: Dict[Tuple[str, str], TimestampDB], jobs: int = 1,
+                 cache: EventCache = None) -> Dict[Tuple[str, str], TextCounters]:
+    """
+    Count the texts of all non master sources per incident group, see collect_group_incidents().
+
+    A source is counted against every group of its categories in a single pass, where each event is
+    classified into a bitmask of the groups it is within and one of those it is applicable to.
+
+    With more than one job the sources are split at line boundaries into byte ranges that are counted in
+    a pool of worker processes, each having its own copy of the incident databases. The partial counters
+    are merged in file order. With a cache, events are taken from the cache and each source is handled
+    as a whole.
+    """
+    sources = [(es, [key for key in groups if key[0] in es.categories]) for es in config.event_sources(master=False)]
+    return _count_sources(config, groups, sources, jobs, cache)
+
+def clustered(config: eca.config.Config, counters: TextCounters) -> TextCounters:
+    """Return counters with similar texts merged if the config has a cluster-threshold, see eca.cluster."""
+    return cluster_texts(counters, config.cluster_threshold) if config.cluster_threshold else counters
+
+def report(config: eca.config.Config, incidents: int, counters: TextCounters, out=sys.stdout,
+           top: int = None) -> None:
+    """
+    Print texts that only occur close to incident events but not otherwise and has at least
+    percentile percent number of hits from total incident events, or only the top of them with the
+    most hits.
+
+    With a cluster-threshold in the config similar texts are merged first, see eca.cluster.
+    """
+    counters = clustered(config, counters)
+    min_count = int((incidents * config.percentile) / 100)
+    logging.info(f"min_count:{min_count}")
+    print("Normalized texts occurring during incident event zone that matches accuracy and percentile settings:", file=out)
+    print("---------------------------------------------------------------------------------------------------", file=out)
+    within, outside = counters.columns[WITHIN], counters.columns[OUTSIDE]
+    # Only the texts passing the thresholds are formatted, and written in chunks instead of line by line.
+    for ids in chunks(counters.matches(min_count, config.accuracy, top), CHUNK_SIZE):
+        out.write("".join(
+            f"within zone:{within[i]} occurrences, out of zone: {outside[i]}"
+            f"{f' ±{1.96 * math.sqrt(counters.variance[i]):.0f}' if i in counters.variance else ''}:\n"
+            f"{escape(counters.texts[i])}\n\n" for i in ids))
+    print("---------------------------------------------------------------------------------------------------", file=out)
+
+    print(f"Total {incidents} incidents, "
+          f"{counters.distinct(WITHIN)} texts found within event range, "
+          f"{counters.distinct(OUTSIDE)} outside. "
+          f"{counters.distinct(NOT_APPLICABLE)} not applicable.", file=out)
+    if counters.skipped:
+        print(f"{counters.skipped} not applicable lines skipped without reading their text.", file=out)
+    if counters.variance:
+        print(f"Out of zone counts are partly estimated from a {100 * config.sample_rate:g}% sample, "
+              f"± is the 95% confidence interval.", file=out)
+
+def report_groups(config: eca.config.Config, incidents: Dict[Tuple[str, str], int],
+                  counters: Dict[Tuple[str, str], TextCounters], out=sys.stdout, top: int = None) -> None:
+    """
+    Print a report per incident group, given the number of incidents of each, headed by its category and group
+    when there is more than one.
+    """
+    for n, (key, count) in enumerate(incidents.items()):
+        title = group_title(incidents, key)
+        if title is not None:
+            if n:
+                print(file=out)
+            print(f"{title}:", file=out)
+        report(config, count, counters[key], out=out, top=top)
+
+def group_results(config: eca.config.Config, incidents: Dict[Tuple[str, str], int],
+                  counters: Dict[Tuple[str, str], TextCounters], top: int = None) -> List[dict]:
+    """
+    Return the matched texts of every incident group, as dicts like those of eca.sweep.sweep_results() with
+    the group added, for the writers of eca.output. Matches with estimated counts have the 95% confidence
+    interval as error.
+    """
+    results = list()
+    for (category, group), count in incidents.items():
+        group_counters = clustered(config, counters[(category, group)])
+        within, outside = group_counters.columns[WITHIN], group_counters.columns[OUTSIDE]
+        matches = list()
+        for i in group_counters.matches(int((count * config.percentile) / 100), config.accuracy, top):
+            match = {'text': group_counters.texts[i], 'within': within[i], 'outside': outside[i]}
+            if i in group_counters.variance:
+                match['error'] = round(1.96 * math.sqrt(group_counters.variance[i]))
+            matches.append(match)
+        results.append({
+            'category': category,
+            'group': group,
+            'range': config.range.total_seconds(),
+            'percentile': config.percentile,
+            'accuracy': config.accuracy,
+            'incidents': count,
+            'matches': matches,
+        })
+    return results
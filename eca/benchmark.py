@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the analysis pipeline on generated logs.
+
+Generates a synthetic workload of incident events and log sources, times each stage of the pipeline
+(parse, normalize, classify, count and report) and the two file comparison of eca.eca.compare_files,
+and writes the results as JSON so that runs on different versions can be compared.
+
+    python -m eca.benchmark --lines 1000000 --incidents 1000 --output results.json
+"""
+import argparse
+from datetime import datetime, timedelta
+import eca
+import eca.config
+from eca.analysis import CHUNK_SIZE, chunks, collect_group_incidents, count_groups, report_groups
+from eca.counters import TextCounters
+from eca.eca import ParserFactory, compare_files
+import io
+import json
+import os
+import platform
+import random
+import string
+import sys
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict, List
+import yaml
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Timestamp layouts that can be generated, as (format of datetime and fraction of second, date-format).
+FORMATS = {
+    'zulu': ("{:%Y-%m-%dT%H:%M:%S}.{:06d}Z", 'auto'),
+    'bracket': ("[{:%Y-%m-%d %H:%M:%S},{:03d}]", 'auto'),
+    'template': ("{:%Y/%m/%d %H:%M:%S}.{:03d}", "{year:4}/{month:2}/{day:2} {hours:2}:{minutes:2}:{seconds:2}."
+                                                "{secondsdecimals}"),
+}
+
+START = datetime(2022, 10, 17)
+
+def _format_time(fmt: str, ts: datetime) -> str:
+    fraction = ts.microsecond if fmt.endswith('Z') else ts.microsecond // 1000
+    return fmt.format(ts, fraction)
+
+def _messages(rnd: random.Random, cardinality: int, line_length: int, line_length_stddev: int) -> List[str]:
+    """Return cardinality distinct message templates with some digits, hashes and uuids to normalize."""
+    words = [''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(2, 9))) for _ in range(500)]
+    messages = list()
+    for i in range(cardinality):
+        length = max(10, int(rnd.gauss(line_length, line_length_stddev)))
+        text = f"{rnd.choice(words)} {i}"
+        while len(text) < length:
+            kind = rnd.random()
+            if kind < 0.05:
+                text += " {uuid}"
+            elif kind < 0.2:
+                text += " {number}"
+            else:
+                text += " " + rnd.choice(words)
+        messages.append(text)
+    return messages
+
+def generate(directory: str, incidents: int = 100, lines: int = 100000, sources: int = 2, line_length: int = 80,
+             line_length_stddev: int = 20, cardinality: int = 1000, formats: List[str] = ('zulu',),
+             normalizers: List[str] = ('no-digits',), range_seconds: float = 1.0, seed: int = 0) -> str:
+    """Generate an incident file, log sources and a config in directory and return the path of the config."""
+    rnd = random.Random(seed)
+    messages = _messages(rnd, cardinality, line_length, line_length_stddev)
+    weights = [1 / (k + 1) for k in range(cardinality)]
+
+    # Spread lines over a period that gives roughly one line per 50 ms.
+    period = timedelta(milliseconds=50 * lines)
+    times = sorted(START + timedelta(microseconds=rnd.randrange(period // timedelta(microseconds=1)))
+                   for _ in range(incidents))
+    config = {'range': f"{range_seconds}s", 'percentile': 10, 'accuracy': 50, 'sources': list()}
+
+    with open(os.path.join(directory, 'incidents.log'), 'w') as fout:
+        for ts in times:
+            print(f"{_format_time(FORMATS['zulu'][0], ts)} incident", file=fout)
+    config['sources'].append({'filename': 'incidents.log', 'master': True})
+
+    for i in range(sources):
+        name = f"source{i}.log"
+        fmt, date_format = FORMATS[formats[i % len(formats)]]
+        count = lines // sources
+        step = period / count
+        with open(os.path.join(directory, name), 'w') as fout:
+            ts = START
+            for msg in rnd.choices(messages, weights=weights, k=count):
+                ts += step
+                text = msg.format(number=rnd.randint(0, 99999), uuid=uuid.UUID(int=rnd.getrandbits(128)))
+                print(f"{_format_time(fmt, ts)} {text}", file=fout)
+        config['sources'].append({'filename': name, 'date-format': date_format, 'normalizers': list(normalizers)})
+
+    filename = os.path.join(directory, 'config.yaml')
+    with open(filename, 'w') as fout:
+        yaml.safe_dump(config, fout, sort_keys=False)
+    return filename
+
+def _timed(func: Callable, repeat: int) -> float:
+    """Return the best wall time of repeat calls to func."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+class _Pipeline:
+    """The stages of the analysis of a config file, as functions to time, on events read in advance."""
+    def __init__(self, config_file: str, jobs: int):
+        self._config_file = config_file
+        self._jobs = jobs
+        self._config = eca.config.Config(config_file)
+        self._sources = list(self._config.event_sources(master=False))
+        self._groups = collect_group_incidents(self._config)
+        self._incidents = {key: len(timestamps) for key, timestamps in self._groups.items()}
+        self._events = [list(es.get_events()) for es in self._sources]
+        self._texts = [[es.normalize(line) for _, line in e] for es, e in zip(self._sources, self._events)]
+        # Indexes of the sources that are counted against each group, and the zones of their events.
+        self._members = {key: [i for i, es in enumerate(self._sources) if key[0] in es.categories]
+                         for key in self._groups}
+        self._zones = {key: {i: self._classify(timestamps, self._events[i]) for i in self._members[key]}
+                       for key, timestamps in self._groups.items()}
+        self._counters = {key: TextCounters() for key in self._groups}
+
+    @staticmethod
+    def _classify(timestamps, events) -> List[int]:
+        return [zone for chunk in chunks(events, CHUNK_SIZE) for zone in timestamps.classify_many([ts for ts, _ in chunk])]
+
+    def workload(self) -> dict:
+        return {'incidents': sum(self._incidents.values()), 'lines': sum(len(e) for e in self._events),
+                'bytes': sum(os.path.getsize(es.filename) for es in self._sources),
+                'texts': len({text for t in self._texts for text in t})}
+
+    def stages(self) -> Dict[str, Callable]:
+        return {
+            'parse': self.parse,
+            'normalize': self.normalize,
+            'classify': self.classify,
+            'count': self.count,
+            'report': self.report,
+            'total': self.total,
+        }
+
+    def parse(self):
+        for es in self._sources:
+            for _ in es.get_events():
+                pass
+
+    def normalize(self):
+        # Fresh sources so the normalizer cache starts cold every round.
+        for es, e in zip(eca.config.Config(self._config_file).event_sources(master=False), self._events):
+            for _, line in e:
+                es.normalize(line)
+
+    def classify(self):
+        for key, timestamps in self._groups.items():
+            for i in self._members[key]:
+                self._classify(timestamps, self._events[i])
+
+    def count(self):
+        for key in self._groups:
+            counters = self._counters[key] = TextCounters()
+            for i in self._members[key]:
+                for zone, text in zip(self._zones[key][i], self._texts[i]):
+                    counters.columns[zone][counters.intern(text)] += 1
+
+    def report(self):
+        report_groups(self._config, self._incidents, self._counters, out=io.StringIO())
+
+    def total(self):
+        # The whole analysis as run by eca, from reading the incidents to the report.
+        groups = collect_group_incidents(self._config)
+        report_groups(self._config, {key: len(timestamps) for key, timestamps in groups.items()},
+                      count_groups(self._config, groups, self._jobs), out=io.StringIO())
+
+def benchmark_pipeline(config_file: str, repeat: int = 3, jobs: int = 1) -> Dict[str, dict]:
+    """Time the stages of the analysis of config_file."""
+    pipeline = _Pipeline(config_file, jobs)
+    workload = pipeline.workload()
+    results = dict()
+    for name, func in pipeline.stages().items():
+        seconds = _timed(func, repeat)
+        results[name] = {'seconds': seconds, 'lines_per_second': workload['lines'] / seconds if seconds else None}
+    seconds = results['total']['seconds']
+    results['total']['bytes_per_second'] = workload['bytes'] / seconds if seconds else None
+    results['workload'] = workload
+    return results
+
+def benchmark_compare_files(directory: str, lines: int = 100000, seed: int = 0, repeat: int = 3) -> Dict[str, float]:
+    """Time eca.eca.compare_files() on two generated files of ISO timestamps."""
+    rnd = random.Random(seed)
+    files = list()
+    for i in range(2):
+        filename = os.path.join(directory, f"compare{i}.log")
+        with open(filename, 'w') as fout:
+            ts = START
+            for _ in range(lines // 2):
+                ts += timedelta(milliseconds=rnd.randint(1, 2000))
+                print(f"{_format_time(FORMATS['zulu'][0], ts)}", file=fout)
+        files.append(filename)
+
+    parsers = [ParserFactory.get_parser('iso') for _ in files]
+    seconds = _timed(lambda: compare_files(files, parsers), repeat)
+    return {'seconds': seconds, 'lines_per_second': lines / seconds if seconds else None}
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog="python -m eca.benchmark", description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument("--incidents", type=int, default=100, help="number of incident events, default 100")
+    parser.add_argument("--lines", type=int, default=100000, help="total number of log lines, default 100000")
+    parser.add_argument("--sources", type=int, default=2, help="number of log sources, default 2")
+    parser.add_argument("--line-length", type=int, default=80, help="mean length of messages, default 80")
+    parser.add_argument("--line-length-stddev", type=int, default=20, help="deviation of message length, default 20")
+    parser.add_argument("--cardinality", type=int, default=1000, help="number of distinct messages, default 1000")
+    parser.add_argument("--formats", default="zulu,bracket",
+                        help=f"comma separated timestamp formats used by the sources, from {','.join(FORMATS)}")
+    parser.add_argument("--normalizers", default="no-uuid,no-digits",
+                        help="comma separated normalizers per source, applied in order")
+    parser.add_argument("--range", type=float, default=1.0, help="incident range in seconds, default 1")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed rounds per stage, best is kept")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of jobs for the total stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", metavar="DIR", help="generate workload in DIR and keep it")
+    parser.add_argument("-o", "--output", help="write JSON results to file instead of stdout")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    formats = args.formats.split(',')
+    normalizers = [n for n in args.normalizers.split(',') if n]
+    for f in formats:
+        if f not in FORMATS:
+            raise RuntimeError(f"unknown format: {f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.keep or tmp
+        os.makedirs(directory, exist_ok=True)
+        config_file = generate(directory, incidents=args.incidents, lines=args.lines, sources=args.sources,
+                               line_length=args.line_length, line_length_stddev=args.line_length_stddev,
+                               cardinality=args.cardinality, formats=formats, normalizers=normalizers,
+                               range_seconds=args.range, seed=args.seed)
+        results = {
+            'version': eca.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__ if np is not None else None,
+            'parameters': {k: v for k, v in vars(args).items() if k not in ('keep', 'output')},
+            'pipeline': benchmark_pipeline(config_file, repeat=args.repeat, jobs=args.jobs),
+            'compare_files': benchmark_compare_files(directory, lines=args.lines, seed=args.seed, repeat=args.repeat),
+        }
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
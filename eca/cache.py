@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of parsed and normalized events.
+
+Each source is stored as three files in the cache directory: the event timestamps as raw int64 epoch
+microseconds, the text id of every event as raw int32, and the table of distinct normalized texts as
+JSON lines. A small JSON file with metadata records which bytes of the source have been parsed, so that
+an unchanged file is never parsed again and an appended file is only parsed from where the cache ends,
+with the days a time-only date-format advanced at midnight in the cached lines.
+The raw columns can be memory mapped, for instance with numpy.memmap.
+"""
+from array import array
+import eca
+from eca.sources import TextEvents
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List
+
+# Increased when the layout of the cache files changes.
+CACHE_FORMAT = 2
+
+# Number of bytes in the start of a source that are hashed to detect a replaced file.
+HEAD_SIZE = 64 * 1024
+
+class CachedEvents:
+    """Columns of the events of a source: timestamps[i] and texts[ids[i]] for every event i."""
+    def __init__(self):
+        self.timestamps = array('q')
+        self.ids = array('i')
+        self.texts: List[str] = list()
+        self._text_ids: Dict[str, int] = dict()
+
+    def append(self, ts: int, text: str) -> None:
+        i = self._text_ids.get(text)
+        if i is None:
+            i = self._text_ids[text] = len(self.texts)
+            self.texts.append(text)
+        self.timestamps.append(ts)
+        self.ids.append(i)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+class EventCache:
+    """
+    Directory of cached events keyed on source file, date parser and normalizers.
+
+    When the total size of the directory exceeds max_size bytes the least recently used sources are evicted.
+    """
+    def __init__(self, directory: str, max_size: int = None):
+        self._directory = directory
+        self._max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _key(self, es: TextEvents) -> str:
+        signature = json.dumps([CACHE_FORMAT, eca.__version__, os.path.abspath(es.filename), es.signature])
+        return hashlib.sha1(signature.encode()).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self._directory, f"{key}.{suffix}")
+
+    @staticmethod
+    def _head_hash(filename: str, size: int) -> str:
+        with open(filename, "rb") as fin:
+            return hashlib.sha1(fin.read(min(size, HEAD_SIZE))).hexdigest()
+
+    def _read(self, key: str, meta: dict) -> CachedEvents:
+        cached = CachedEvents()
+        with open(self._path(key, 'ts'), "rb") as fin:
+            cached.timestamps.fromfile(fin, meta['events'])
+        with open(self._path(key, 'ids'), "rb") as fin:
+            cached.ids.fromfile(fin, meta['events'])
+        with open(self._path(key, 'texts'), "rb") as fin:
+            for _ in range(meta['texts']):
+                cached.texts.append(json.loads(fin.readline()))
+        cached._text_ids = {text: i for i, text in enumerate(cached.texts)}
+        return cached
+
+    def _write(self, key: str, meta: dict, cached: CachedEvents, events: int, texts: int) -> None:
+        """Write everything after the first events and texts to the cache files, then the metadata."""
+        mode = "r+b" if events else "wb"
+        for suffix, column in (('ts', cached.timestamps), ('ids', cached.ids)):
+            with open(self._path(key, suffix), mode) as fout:
+                fout.seek(events * column.itemsize)
+                fout.truncate()
+                column[events:].tofile(fout)
+        with open(self._path(key, 'texts'), "r+b" if texts else "wb") as fout:
+            for _ in range(texts):
+                fout.readline()
+            fout.truncate()
+            fout.writelines(json.dumps(text).encode() + b"\n" for text in cached.texts[texts:])
+        meta.update(events=len(cached), texts=len(cached.texts))
+        tmp = self._path(key, 'json.tmp')
+        with open(tmp, "w") as fout:
+            json.dump(meta, fout)
+        os.replace(tmp, self._path(key, 'json'))
+
+    def load(self, es: TextEvents) -> CachedEvents:
+        """Return the events of es, parsing only what is not in the cache and updating the cache."""
+        key = self._key(es)
+        stat = os.stat(es.filename)
+        meta = None
+        try:
+            with open(self._path(key, 'json')) as fin:
+                meta = json.load(fin)
+        except (OSError, ValueError):
+            pass
+
+        cached = None
+        try:
+            if meta and meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime_ns:
+                logging.info(f"{es.filename}: read from cache")
+                os.utime(self._path(key, 'json'))
+                self._evict(keep=key)
+                es.restore_parser_state(meta['parser'])
+                return self._read_tail(es, self._read(key, meta), meta['offset'], stat.st_size)
+
+            if meta and meta['offset'] <= stat.st_size and meta['head'] == self._head_hash(es.filename, meta['offset']):
+                logging.info(f"{es.filename}: read from cache, parsing from offset {meta['offset']}")
+                cached = self._read(key, meta)
+        except (OSError, EOFError, ValueError) as e:
+            logging.warning(f"{es.filename}: ignoring broken cache: {e}")
+            cached = None
+        if cached is None:
+            meta = {'filename': os.path.abspath(es.filename), 'offset': 0}
+            cached = CachedEvents()
+
+        events, texts = len(cached), len(cached.texts)
+        start = meta['offset']
+        end = es.complete_lines_end(start)
+        # A date parser that rolls over at midnight continues with the days of the cached lines.
+        es.restore_parser_state(meta.get('parser'))
+        for ts, line in es.get_events(start, end):
+            cached.append(ts, es.normalize(line))
+
+        meta.update(offset=end, size=stat.st_size, mtime=stat.st_mtime_ns,
+                    head=self._head_hash(es.filename, end), parser=es.parser_state())
+        self._write(key, meta, cached, events, texts)
+        self._evict(keep=key)
+        return self._read_tail(es, cached, end, stat.st_size)
+
+    @staticmethod
+    def _read_tail(es: TextEvents, cached: CachedEvents, start: int, size: int) -> CachedEvents:
+        """Add a last line without newline, which is not cached since it may still be written to."""
+        if start < size:
+            for ts, line in es.get_events(start, size):
+                cached.append(ts, es.normalize(line))
+        return cached
+
+    def _evict(self, keep: str) -> None:
+        """Remove least recently used sources until the cache fits in max_size."""
+        if self._max_size is None:
+            return
+        entries = dict()
+        total = 0
+        for name in os.listdir(self._directory):
+            key = name.split('.')[0]
+            size = os.path.getsize(os.path.join(self._directory, name))
+            entries.setdefault(key, [0, 0])[0] += size
+            total += size
+            if name.endswith('.json'):
+                entries[key][1] = os.path.getmtime(os.path.join(self._directory, name))
+
+        for key, (size, _) in sorted(entries.items(), key=lambda e: e[1][1]):
+            if total <= self._max_size:
+                break
+            if key == keep:
+                continue
+            for suffix in ('json', 'ts', 'ids', 'texts'):
+                try:
+                    os.remove(self._path(key, suffix))
+                except FileNotFoundError:
+                    pass
+            total -= size
+            logging.info(f"evicted {key} from cache")
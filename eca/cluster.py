@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Clustering of near duplicate texts.
+
+Texts that the normalizers leave apart but that are almost the same split the counts of one message between
+them. cluster_texts() merges them: texts are taken in order of falling total count and each one joins the
+first cluster scoring at least the threshold, trying those most likely to be similar first, or else starts
+a cluster of its own with itself as representative.
+
+To avoid comparing all pairs, every text gets a MinHash signature of its tokens that is split into bands,
+and a text is only compared with the representatives that have an identical band (locality sensitive
+hashing). Scores are thefuzz's fuzz.ratio() when it is installed, otherwise the same ratio from difflib,
+and are memoized.
+"""
+from collections import Counter
+from difflib import SequenceMatcher
+from eca.counters import TextCounters
+from functools import lru_cache
+import logging
+import random
+from typing import Dict, List, Tuple
+import zlib
+
+try:
+    from thefuzz import fuzz
+except ImportError:
+    fuzz = None
+
+# The MinHash signature of a text has BANDS * ROWS values, texts with an identical band are compared.
+BANDS = 8
+ROWS = 3
+
+# Most representatives compared with a text, those sharing the most bands first.
+MAX_CANDIDATES = 32
+
+# Number of memoized scores.
+SCORE_CACHE_SIZE = 1024 * 1024
+
+_PRIME = (1 << 31) - 1
+_rnd = random.Random(0)
+_PERMUTATIONS = [(_rnd.randrange(1, _PRIME), _rnd.randrange(_PRIME)) for _ in range(BANDS * ROWS)]
+
+@lru_cache(maxsize=SCORE_CACHE_SIZE)
+def score(a: str, b: str) -> int:
+    """Return similarity of a and b from 0 to 100."""
+    if fuzz is not None:
+        return fuzz.ratio(a, b)
+    return round(100 * SequenceMatcher(None, a, b, autojunk=False).ratio())
+
+@lru_cache(maxsize=SCORE_CACHE_SIZE)
+def _token_hashes(token: str) -> Tuple[int, ...]:
+    h = zlib.crc32(token.encode('utf-8', 'replace'))
+    return tuple((a * h + b) % _PRIME for a, b in _PERMUTATIONS)
+
+def bands(text: str) -> List[Tuple[int, Tuple[int, ...]]]:
+    """Return the bands of the MinHash signature of the tokens of text, tagged with the band number."""
+    # Tokens repeat a lot between log texts, so their hashes are memoized and only the minimums are per text.
+    hashes = list(map(min, zip(*map(_token_hashes, text.split() or [""]))))
+    return [(band, tuple(hashes[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+def cluster_texts(counters: TextCounters, threshold: int) -> TextCounters:
+    """
+    Return counters where texts with a similarity of at least threshold percent are merged into one, which
+    is represented by its most frequent text.
+    """
+    columns = counters.columns
+    totals = [sum(column[i] for column in columns) for i in range(len(counters))]
+    result = TextCounters()
+    result.skipped = counters.skipped
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = dict()
+    compared = 0
+
+    for i in sorted(range(len(counters)), key=totals.__getitem__, reverse=True):
+        text = counters.texts[i]
+        keys = bands(text)
+        shared = Counter(r for key in keys for r in buckets.get(key, ()))
+        best = None
+        for r, _ in shared.most_common(MAX_CANDIDATES):
+            other = result.texts[r]
+            # The ratio can not be higher than what the difference in length allows.
+            if 200 * min(len(text), len(other)) < threshold * (len(text) + len(other)):
+                continue
+            compared += 1
+            if score(other, text) >= threshold:
+                best = r
+                break
+
+        if best is None:
+            best = result.intern(text)
+            for key in keys:
+                buckets.setdefault(key, []).append(best)
+        for column, result_column in zip(columns, result.columns):
+            result_column[best] += column[i]
+        if i in counters.variance:
+            result.variance[best] = result.variance.get(best, 0.0) + counters.variance[i]
+
+    logging.info(f"clustered {len(counters)} texts into {len(result)} with {compared} comparisons")
+    return result
@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 
 from datetime import timedelta
-from eca.sources import TextEvents
+from eca.sources import MetricValues, TextEvents
 import eca.dateparser
+import eca.sources
+import json
 import os
+import eca.normalizer
 from eca.normalizer import Normalizer
-from typing import Iterator
+from typing import Iterator, List
 import yaml
 
+def parse_range(value: str) -> timedelta:
+    """Return a range given as seconds with an s suffix, like 1.5s."""
+    if value.endswith('s'):
+        return timedelta(seconds=float(value[:-1]))
+    else:
+        raise RuntimeError(f"Unknown time format for range: {value}")
+
 class Config:
     global_defaults = {
         "range": "1s",
@@ -20,11 +30,19 @@ class Config:
         'date-format': 'auto',
         'type': 'text-events',
         'categories': ['main'],
+        'encoding': 'utf-8',
+        'encoding-errors': 'replace',
+        'buffer-size': eca.sources.BUFFER_SIZE,
+        'normalizer-cache-size': eca.normalizer.CACHE_SIZE,
+        'mmap': False,
+        'sorted': False,
+        'group': None,
     }
 
     def __init__(self, filename):
         self._dir = os.path.dirname(filename)
         self._event_sources = list()
+        self._metric_sources = list()
         with open(filename, "r") as stream:
             self._config = yaml.safe_load(stream)
 
@@ -39,17 +57,39 @@ class Config:
 
             filename = e['filename'] if os.path.isabs(e['filename']) else os.path.join(self._dir, e['filename'])
 
-            date_parser = eca.dateparser.create_parser_from_str(e['date-format'])
-
-            if e['type'] == 'text-events':
-                es = TextEvents(filename=filename, date_parser=date_parser, master=e['master'])
-            else:
-                raise RuntimeError(f"unknown event type: {e['type']}")
-
-            for n in e.get('normalizers', []):
-                es.add_normalizer(Normalizer.create_from_str(n))
-
-            self._event_sources.append(es)
+            if isinstance(e['categories'], str):
+                e['categories'] = [e['categories']]
+
+            signature = json.dumps([str(e.get(k)) for k in ('date-format', 'timezone', 'default-date', 'default-time',
+                                                            'encoding', 'encoding-errors', 'normalizers')])
+
+            # A directory or glob pattern is a source for each of its files, oldest first.
+            for path in eca.sources.expand_filename(filename):
+                date_parser = eca.dateparser.create_parser_from_str(e['date-format'], timezone=e.get('timezone'),
+                                                                    default_date=e.get('default-date'),
+                                                                    default_time=e.get('default-time'))
+
+                if e['type'] == 'text-events':
+                    es = TextEvents(filename=path, date_parser=date_parser, master=e['master'],
+                                    encoding=e['encoding'], errors=e['encoding-errors'], buffer_size=e['buffer-size'],
+                                    cache_size=e['normalizer-cache-size'], signature=signature,
+                                    use_mmap=e['mmap'], time_sorted=e['sorted'],
+                                    categories=e['categories'], group=e['group'])
+                elif e['type'] == 'metric-values':
+                    if e['master']:
+                        raise RuntimeError(f"metric-values source can not be master: {e['filename']}")
+                    self._metric_sources.append(MetricValues(filename=path, date_parser=date_parser,
+                                                             encoding=e['encoding'], errors=e['encoding-errors'],
+                                                             buffer_size=e['buffer-size'],
+                                                             categories=e['categories']))
+                    continue
+                else:
+                    raise RuntimeError(f"unknown event type: {e['type']}")
+
+                for n in e.get('normalizers', []):
+                    es.add_normalizer(Normalizer.create_from_str(n))
+
+                self._event_sources.append(es)
 
     def event_sources(self, master: bool = None) -> Iterator[eca.sources.TextEvents]:
         """Return list of even sources."""
@@ -57,12 +97,50 @@ class Config:
             if master is None or master == es.is_master():
                 yield es
 
+    def metric_sources(self) -> Iterator[eca.sources.MetricValues]:
+        """Return list of metric sources."""
+        return iter(self._metric_sources)
+
+    @property
+    def categories(self) -> List[str]:
+        """Return the categories of all sources, in order of first appearance."""
+        return list(dict.fromkeys(c for es in self._event_sources + self._metric_sources for c in es.categories))
+
     @property
     def range(self) -> timedelta:
-        if self._config['range'].endswith('s'):
-            return timedelta(seconds=float(self._config['range'][:-1]))
-        else:
-            raise RuntimeError(f"Unknown time format for range: {self._config['range']}")
+        return parse_range(self._config['range'])
+
+    @property
+    def cache_dir(self) -> str:
+        """Directory for cached events, or None when caching is off."""
+        directory = self._config.get('cache-dir')
+        if directory is None or os.path.isabs(directory):
+            return directory
+        return os.path.join(self._dir, directory)
+
+    @property
+    def cache_max_size(self) -> int:
+        """Max size of the cache directory in bytes, given as a number with an optional K, M or G suffix."""
+        size = self._config.get('cache-max-size')
+        if size is None or isinstance(size, int):
+            return size
+        units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+        if size[-1:].upper() in units:
+            return int(float(size[:-1]) * units[size[-1:].upper()])
+        return int(size)
+
+    @property
+    def sample_rate(self) -> float:
+        """Fraction of the lines between incident zones of sorted sources that are read, or None to read all."""
+        rate = self._config.get('sample-rate')
+        if rate is not None and not 0 < rate <= 1:
+            raise RuntimeError(f"sample-rate must be above 0 and at most 1: {rate}")
+        return rate
+
+    @property
+    def cluster_threshold(self) -> int:
+        """Similarity in percent at which texts are merged into one, or None to not cluster texts."""
+        return self._config.get('cluster-threshold')
 
     @property
     def percentile(self) -> int:
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+from array import array
+from eca.timestamp import OUTSIDE, WITHIN
+import heapq
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class TextCounters:
+    """
+    Counters for how many times each normalized text occurs within, outside and not applicable to the
+    incident zones.
+
+    Every distinct text is interned once into a dense integer id, and the counts live in one array('q')
+    column per zone indexed by that id, so the text is stored once instead of once per zone.
+    """
+    def __init__(self):
+        self._ids: Dict[str, int] = dict()
+        self.texts: List[str] = list()
+        # Indexed by zone, NOT_APPLICABLE, OUTSIDE and WITHIN.
+        self.columns = (array('q'), array('q'), array('q'))
+        # Not applicable events that were counted without reading their text.
+        self.skipped: int = 0
+        # Variance of outside counts that are estimated from a sample, by text id.
+        self.variance: Dict[int, float] = dict()
+
+    @classmethod
+    def from_columns(cls, texts: List[str], columns: Tuple[array, array, array]) -> "TextCounters":
+        """Return counters for texts with the counts given per zone, the texts list is shared, not copied."""
+        counters = cls()
+        counters.texts = texts
+        counters._ids = {text: i for i, text in enumerate(texts)}
+        counters.columns = columns
+        return counters
+
+    def intern(self, text: str) -> int:
+        """Return id of text, adding it if needed."""
+        i = self._ids.get(text)
+        if i is None:
+            i = self._ids[text] = len(self.texts)
+            self.texts.append(text)
+            for column in self.columns:
+                column.append(0)
+        return i
+
+    def add(self, text: str, zone: int, count: int = 1) -> None:
+        self.columns[zone][self.intern(text)] += count
+
+    def merge(self, other: "TextCounters") -> None:
+        """Add the counts of other to this."""
+        for i, text in enumerate(other.texts):
+            j = self.intern(text)
+            for column, other_column in zip(self.columns, other.columns):
+                column[j] += other_column[i]
+            if i in other.variance:
+                self.variance[j] = self.variance.get(j, 0.0) + other.variance[i]
+        self.skipped += other.skipped
+
+    def distinct(self, zone: int) -> int:
+        """Return number of distinct texts that occurred at least once in zone."""
+        column = self.columns[zone]
+        if np is not None:
+            return int(np.count_nonzero(np.frombuffer(column, dtype=np.int64)))
+        return len(column) - column.count(0)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def matches(self, min_count: int, accuracy: int, top: int = None) -> List[int]:
+        """
+        Return ids of texts seen within the zones at least min_count times and with at least accuracy percent
+        of all their applicable occurrences within the zones, ordered by descending within count, and only the
+        first top of them if given.
+
+        With top only the matches that can be among the first are sorted, texts with equal counts stay in
+        order of id either way.
+        """
+        within, outside = self.columns[WITHIN], self.columns[OUTSIDE]
+        if np is not None and len(self.texts):
+            w = np.frombuffer(within, dtype=np.int64)
+            o = np.frombuffer(outside, dtype=np.int64)
+            ids = np.flatnonzero((w > 0) & (w >= min_count) & ((w * 100) // np.maximum(w + o, 1) >= accuracy))
+            if top is not None and top < len(ids):
+                # Keep the matches counted at least as often as the top-th, ties included.
+                ids = ids[w[ids] >= -np.partition(-w[ids], top - 1)[top - 1]]
+            return ids[np.argsort(-w[ids], kind='stable')][:top].tolist()
+
+        ids = [i for i, w in enumerate(within)
+               if w > 0 and w >= min_count and (w * 100) // (w + outside[i]) >= accuracy]
+        if top is not None:
+            return heapq.nlargest(top, ids, key=within.__getitem__)
+        return sorted(ids, key=within.__getitem__, reverse=True)
+
+    def __getstate__(self):
+        return {'texts': self.texts, 'columns': self.columns, 'skipped': self.skipped,
+                'variance': self.variance}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._ids = {text: i for i, text in enumerate(self.texts)}
@@ -1,38 +1,112 @@
 #!/usr/bin/env python3
 from abc import ABC
 import eca.dateparser
-from datetime import datetime
+from eca.timestamp import epoch, to_epoch
+from datetime import date, datetime
 import re
-from typing import Protocol, List, Tuple
+from typing import Dict, Protocol, List, Tuple
 
 class DateParser(Protocol):
-    def process(self, line: str) -> Tuple[datetime, str]:
+    def process(self, line: str) -> Tuple[int, str]:
         ...
 
+def microseconds(decimals: str) -> int:
+    """Return microseconds for the decimals of a second, without going through float."""
+    return int(decimals[:6].ljust(6, '0')) if decimals else 0
+
+
+_DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+_DIGITS = re.compile(r'\d*')
+
+def _valid(year: int, month: int, day: int, hours: int, minutes: int, seconds: int) -> bool:
+    """Return whether the fields are a valid date and time of day."""
+    if not (1 <= month <= 12 and 1 <= day <= _DAYS_IN_MONTH[month]):
+        return False
+    if month == 2 and day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+        return False
+    return hours < 24 and minutes < 60 and seconds < 60
+
+class FixedLayout:
+    """
+    Fast path for timestamps at fixed character offsets in the start of a line.
+
+    Handles layouts like 2022-10-17T12:39:31.705894Z and [2022-10-17 12:39:31,705] by slicing instead
+    of regex matching. A line that does not fit the layout is a miss and returns (None, line), callers
+    are expected to fall back to a regex parser then.
+    """
+    def __init__(self, brackets: bool, separators: str, fraction_separators: str, zulu: bool):
+        self._brackets = brackets
+        self._separators = separators
+        self._fraction_separators = fraction_separators
+        self._zulu = zulu
+
+    def process(self, line: str) -> Tuple[int, str]:
+        """Extracts timestamp from line and return (epoch-microseconds, line-without-timestamp)."""
+        o = 1 if self._brackets and line[:1] == '[' else 0
+        if len(line) < o + 19 or line[o+4] != '-' or line[o+7] != '-' or line[o+10] not in self._separators:
+            return None, line
+        if line[o+13] != ':' or line[o+16] != ':':
+            return None, line
+
+        year, month, day = line[o:o+4], line[o+5:o+7], line[o+8:o+10]
+        hours, minutes, seconds = line[o+11:o+13], line[o+14:o+16], line[o+17:o+19]
+        if not (year + month + day + hours + minutes + seconds).isdecimal():
+            return None, line
+        year, month, day = int(year), int(month), int(day)
+        hours, minutes, seconds = int(hours), int(minutes), int(seconds)
+        if not _valid(year, month, day, hours, minutes, seconds):
+            return None, line
+
+        end = o + 19
+        if line[end:end+1].isdecimal():
+            return None, line
+        decimals = ''
+        if line[end:end+1] and line[end] in self._fraction_separators:
+            match = _DIGITS.match(line, end + 1)
+            decimals = match.group()
+            end = match.end()
+        end = self._suffix_end(line, end)
+        if end is None:
+            return None, line
+
+        return epoch(year, month, day, hours, minutes, seconds, microseconds(decimals)), line[end:]
+
+    def _suffix_end(self, line: str, end: int) -> int:
+        """Return the end of the timestamp after its seconds at end, or None when the suffix does not fit."""
+        if self._zulu:
+            return end + 1 if line[end:end+1] == 'Z' else None
+        if line[end:end+1] == 'Z':
+            # A Zulu timestamp, left to ZuluParser so the text does not depend on the parser that matched.
+            return None
+        return end + 1 if self._brackets and line[end:end+1] == ']' else end
+
 class ReParser(ABC):
-    def process(self, line) -> Tuple[datetime, str]:
-        """Extracts timestamp from line and return (timestamp, line-without-timestamp)."""
+    _layout: FixedLayout = None
+
+    def process(self, line) -> Tuple[int, str]:
+        """Extracts timestamp from line and return (epoch-microseconds, line-without-timestamp)."""
+        if self._layout is not None:
+            res = self._layout.process(line)
+            if res[0] is not None:
+                return res
+
         match = self._re.search(line)
         if match:
-            if match.group('secondsdecimals'):
-                microseconds = int(1000000 * float("0." + match.group('secondsdecimals')))
-            else:
-                microseconds = 0
-
             time = datetime(int(match.group('year')),
                             int(match.group('month')),
                             int(match.group('day')),
                             int(match.group('hours')),
                             int(match.group('minutes')),
                             int(match.group('seconds')),
-                            microseconds)
-            line = self._re.sub('', line)
-            return time, line
+                            microseconds(match.group('secondsdecimals')))
+            line = line[:match.start()] + line[match.end():]
+            return to_epoch(time), line
 
         return None, line
 
 class ZuluParser(ReParser):
     """Parsers zulu or UTC timestamps."""
+    _layout = FixedLayout(brackets=False, separators='T', fraction_separators='.', zulu=True)
     _re = re.compile(r'(?P<year>\d\d\d\d)-'
                      r'(?P<month>\d\d)-'
                      r'(?P<day>\d\d)T'
@@ -43,6 +117,7 @@ class ZuluParser(ReParser):
                      r'(?P<secondsdecimals>\d+)?Z')
 
 class BracketFulltimeParser(ReParser):
+    _layout = FixedLayout(brackets=True, separators=' T', fraction_separators=',.', zulu=False)
     _re = re.compile(r'\[?(?P<year>\d\d\d\d)-'
                      r'(?P<month>\d\d)-'
                      r'(?P<day>\d\d)'
@@ -50,29 +125,296 @@ class BracketFulltimeParser(ReParser):
                      r'(?P<hours>\d\d):'
                      r'(?P<minutes>\d\d):'
                      r'(?P<seconds>\d+)'
-                     r'(?:[,\.])?'
-                     r'(?P<secondsdecimals>\d+)?\]?')
+                     r'(?:[,\.](?P<secondsdecimals>\d+))?'
+                     r'(?![,\.]?\d|Z)\]?')
+
+def _parser_name(parser: DateParser) -> str:
+    return type(getattr(parser, 'parser', parser)).__name__
 
 class AutoParser:
-    parsers: List[DateParser] = [
-        ZuluParser(),
-        BracketFulltimeParser(),
-    ]
+    """
+    Detects the timestamp format of a source.
 
-    def __init__(self):
-        ...
+    The parser that matched last is tried first on the next line, the others are only probed, in
+    priority order, when it misses. Counters of hits and misses for the current parser are kept in
+    hits and misses. Timestamps without a zone are converted from timezone to UTC, Zulu timestamps
+    are UTC already.
+    """
+    def __init__(self, timezone=None):
+        bracket = BracketFulltimeParser()
+        self.parsers: List[DateParser] = [
+            ZuluParser(),
+            TimezoneParser(bracket, timezone) if timezone_offset(timezone) else bracket,
+        ]
+        self._current: DateParser = self.parsers[0]
+        self.hits: int = 0
+        self.misses: int = 0
+        # Hits of the parsers before the current one took over at hits _switched_at.
+        self._hits_by_parser: Dict[str, int] = dict()
+        self._switched_at: int = 0
+
+    def hits_by_parser(self) -> Dict[str, int]:
+        """Return the number of lines parsed by each parser."""
+        hits = dict(self._hits_by_parser)
+        name = _parser_name(self._current)
+        hits[name] = hits.get(name, 0) + self.hits - self._switched_at
+        return hits
 
     def process(self, line: str):
+        res = self._current.process(line)
+        if res[0] is not None:
+            self.hits += 1
+            return res
+
+        self.misses += 1
         for p in self.parsers:
-            res = p.process(line)
-            if res[0]:
-                return res
+            if p is not self._current:
+                res = p.process(line)
+                if res[0] is not None:
+                    self._hits_by_parser = self.hits_by_parser()
+                    self._switched_at = self.hits
+                    self._current = p
+                    name = _parser_name(p)
+                    self._hits_by_parser[name] = self._hits_by_parser.get(name, 0) + 1
+                    return res
         else:
             return None, line
 
 
-def create_parser_from_str(type: str) -> DateParser:
+_TEMPLATE_FIELD = re.compile(r'\{(?P<name>\w+)(?::(?P<width>\d+))?\}')
+_FIELD_PATTERNS = {
+    'year': r'\d{4}',
+    'month': r'\d{1,2}',
+    'monthname': r'[A-Za-z]{3}',
+    'day': r'\d{1,2}',
+    'hours': r'\d{1,2}',
+    'minutes': r'\d{2}',
+    'seconds': r'\d{2}',
+    'secondsdecimals': r'\d+',
+    # dmesg pads the seconds with spaces, like [   13.380].
+    'delta': r' *[+-]?\d+(?:\.\d*)?',
+}
+_DAY = 24 * 3600 * 1000000
+# A time of day this much before the previous one is taken to be on the next day.
+_ROLLOVER = _DAY // 2
+_MONTH_NAMES = {name: i for i, name in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                                                  'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+
+def timezone_offset(timezone) -> int:
+    """Return offset in microseconds for a timezone given as hours, like +2 or -5.5, or as "+HH:MM"."""
+    if timezone is None or timezone in ('Z', 'UTC'):
+        return 0
+    if isinstance(timezone, str):
+        match = re.fullmatch(r'(?P<sign>[+-]?)(?P<hours>\d{1,2})(?::?(?P<minutes>\d\d))?', timezone.strip())
+        if not match:
+            raise RuntimeError(f"Unknown timezone: {timezone}")
+        minutes = int(match.group('hours')) * 60 + int(match.group('minutes') or 0)
+        offset = minutes * 60 * 1000000
+        return -offset if match.group('sign') == '-' else offset
+    if abs(timezone) > 24:
+        raise RuntimeError(f"Timezone out of range, expected hours: {timezone}")
+    return int(round(timezone * 3600 * 1000000))
+
+def parse_default_date(value) -> Tuple[int, int, int]:
+    """Return (year, month, day) for a default-date given as YYYY-MM-DD."""
+    if isinstance(value, date):
+        return value.year, value.month, value.day
+    match = re.fullmatch(r'(\d{4})-(\d{1,2})-(\d{1,2})', str(value).strip())
+    if not match:
+        raise RuntimeError(f"Unknown format for default-date: {value}")
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+def parse_default_time(value) -> int:
+    """Return microseconds since midnight for a default-time given as HH:MM[:SS[.decimals]]."""
+    if value is None:
+        return 0
+    if isinstance(value, int):
+        # YAML reads unquoted 12:00:00 as a sexagesimal number of seconds.
+        return value * 1000000
+    match = re.fullmatch(r'(\d{1,2}):(\d\d)(?::(\d\d)(?:[.,](\d+))?)?', str(value).strip())
+    if not match:
+        raise RuntimeError(f"Unknown format for default-time: {value}")
+    seconds = (int(match.group(1)) * 60 + int(match.group(2))) * 60 + int(match.group(3) or 0)
+    return seconds * 1000000 + microseconds(match.group(4))
+
+def _delta(value: str) -> int:
+    """Return microseconds for a number of seconds like -13.38."""
+    value = value.strip()
+    whole, _, decimals = value.lstrip('+-').partition('.')
+    delta = int(whole) * 1000000 + microseconds(decimals)
+    return -delta if value.startswith('-') else delta
+
+class TemplateParser:
+    """
+    Parses timestamps described by a date-format template.
+
+    A template like "{year:4}-{month:2}-{day:2} {hours:2}:{minutes:2}:{seconds:2}.{secondsdecimals}" is
+    compiled once into a regex and, when all fields but the last have a width, into a list of fixed
+    offsets that is tried first on the start of the line. Date fields missing in the template are taken
+    from default_date. A template with only {delta} gives seconds relative to default_date and default_time.
+    Timestamps are converted from timezone to UTC.
+
+    A template without any date field advances the date by a day when the time of day goes back by more
+    than half a day, at midnight. The parser then depends on the lines before, so rolls_over is set and
+    a source has to be read from its start, after reset(), or after restore() of the state() the lines
+    before left.
+    """
+    def __init__(self, template: str, timezone=None, default_date=None, default_time=None):
+        self._tokens = list()
+        pos = 0
+        for match in _TEMPLATE_FIELD.finditer(template):
+            if match.start() > pos:
+                self._tokens.append(template[pos:match.start()])
+            name = match.group('name')
+            if name not in _FIELD_PATTERNS:
+                raise RuntimeError(f"unknown date-format field: {name}")
+            width = int(match.group('width')) if match.group('width') else (3 if name == 'monthname' else None)
+            self._tokens.append((name, width))
+            pos = match.end()
+        if pos < len(template):
+            self._tokens.append(template[pos:])
+
+        names = {t[0] for t in self._tokens if isinstance(t, tuple)}
+        if 'delta' in names and len(names) > 1:
+            raise RuntimeError(f"delta can not be combined with other fields in date-format: {template}")
+        if not names & {'year', 'month', 'monthname', 'day'} and default_date is None:
+            raise RuntimeError(f"default-date is needed for date-format: {template}")
+
+        self._offset = timezone_offset(timezone)
+        self._default_date = parse_default_date(default_date) if default_date is not None else None
+        self._base = epoch(*self._default_date) + parse_default_time(default_time) if self._default_date else 0
+        self._re = re.compile(''.join(self._token_pattern(t) for t in self._tokens))
+        self._layout = self._compile_layout()
+        self.rolls_over = not names & {'year', 'month', 'monthname', 'day', 'delta'}
+        self._days = 0
+        self._last = None
+
+    def reset(self) -> None:
+        """Forget the days advanced at midnight, for reading a source again from its start."""
+        self._days = 0
+        self._last = None
+
+    def state(self) -> Tuple[int, int]:
+        """Return the days advanced at midnight and the last timestamp, to continue parsing with restore()."""
+        return self._days, self._last
+
+    def restore(self, state: Tuple[int, int]) -> None:
+        self._days, self._last = state
+
+    def _roll_over(self, ts: int) -> int:
+        ts += self._days * _DAY
+        if self._last is not None and ts < self._last - _ROLLOVER:
+            self._days += 1
+            ts += _DAY
+        self._last = ts
+        return ts
+
+    @staticmethod
+    def _token_pattern(token) -> str:
+        if isinstance(token, str):
+            # A space in the template matches any number of spaces.
+            return ' +'.join(re.escape(s) for s in re.split(' +', token))
+        name, width = token
+        pattern = r'\d{%d}' % width if width and name != 'monthname' else _FIELD_PATTERNS[name]
+        return f"(?P<{name}>{pattern})"
+
+    def _compile_layout(self):
+        """Return [(offset, token, pattern)] when the template has fixed offsets in the start of a line, else None."""
+        layout = list()
+        offset = 0
+        for i, token in enumerate(self._tokens):
+            if isinstance(token, str):
+                layout.append((offset, token, None))
+                offset += len(token)
+            elif token[1] is not None:
+                layout.append((offset, token, None))
+                offset += token[1]
+            elif i == len(self._tokens) - 1:
+                layout.append((offset, token, re.compile(_FIELD_PATTERNS[token[0]])))
+            else:
+                return None
+        return layout
+
+    def _slice(self, line: str):
+        """Return (values, end) for the fixed offset layout or None when the line does not fit."""
+        values = dict()
+        end = 0
+        for offset, token, pattern in self._layout:
+            if isinstance(token, str):
+                if not line.startswith(token, offset):
+                    return None
+                end = offset + len(token)
+                continue
+            name, width = token
+            if pattern is not None:
+                match = pattern.match(line, offset)
+                if not match:
+                    return None
+                value, end = match.group(), match.end()
+            else:
+                value, end = line[offset:offset + width], offset + width
+                if len(value) != width or not (value.isalpha() if name == 'monthname' else value.isdecimal()):
+                    return None
+            values[name] = value
+        return values, end
+
+    def _timestamp(self, values) -> int:
+        """Return epoch microseconds in UTC for the parsed fields or None if they are not a valid time."""
+        if 'delta' in values:
+            return self._base + _delta(values['delta']) - self._offset
+
+        year, month, day = self._default_date or (None, None, None)
+        year = int(values['year']) if 'year' in values else year
+        month = _MONTH_NAMES.get(values['monthname'].lower()) if 'monthname' in values else month
+        month = int(values['month']) if 'month' in values else month
+        day = int(values['day']) if 'day' in values else day
+        hours = int(values.get('hours', 0))
+        minutes = int(values.get('minutes', 0))
+        seconds = int(values.get('seconds', 0))
+        if year is None or month is None or day is None:
+            return None
+        if not _valid(year, month, day, hours, minutes, seconds):
+            return None
+        ts = epoch(year, month, day, hours, minutes, seconds, microseconds(values.get('secondsdecimals'))) - self._offset
+        return self._roll_over(ts) if self.rolls_over else ts
+
+    def process(self, line: str) -> Tuple[int, str]:
+        """Extracts timestamp from line and return (epoch-microseconds, line-without-timestamp)."""
+        if self._layout is not None:
+            res = self._slice(line)
+            if res is not None:
+                ts = self._timestamp(res[0])
+                if ts is not None:
+                    return ts, line[res[1]:]
+
+        match = self._re.search(line)
+        if match:
+            ts = self._timestamp(match.groupdict())
+            if ts is not None:
+                return ts, line[:match.start()] + line[match.end():]
+
+        return None, line
+
+class TimezoneParser:
+    """Converts the timestamps of another parser from a local timezone to UTC."""
+    def __init__(self, parser: DateParser, timezone):
+        self.parser = parser
+        self._offset = timezone_offset(timezone)
+
+    def process(self, line: str) -> Tuple[int, str]:
+        ts, line = self.parser.process(line)
+        if ts is not None:
+            ts -= self._offset
+        return ts, line
+
+
+def create_parser_from_str(type: str, timezone=None, default_date=None, default_time=None) -> DateParser:
+    # Zulu timestamps are UTC, timezone only applies to the formats without a zone.
     if type == 'auto':
-        return eca.dateparser.AutoParser()
+        return eca.dateparser.AutoParser(timezone)
+    elif type == 'iso':
+        return eca.dateparser.ZuluParser()
+    elif _TEMPLATE_FIELD.search(type):
+        return TemplateParser(type, timezone=timezone, default_date=default_date, default_time=default_time)
     else:
         raise RuntimeError(f"unknown date-parser: {type}")
@@ -2,18 +2,24 @@
 """
 Simple script to match timed events.
 
-It compare two files with event dates and calculates how many of them match in time.
+It compare files with event dates and calculates how many of them match in time.
 This can be used for instance to grep out from one file the events when an incident occurs
 and then grep out from logfiles suspicious entries. By comparing the times from those one
 gets amatch number of how many coincide in time.
+
+Each file is parsed once into a sorted list of epoch timestamps and every pair of files is
+matched in a merge join, where runs of events that can not match are skipped by binary search.
 """
 from abc import abstractmethod
+from array import array
 import argparse
-from datetime import datetime, timedelta
+from bisect import bisect_left
+from eca.dateparser import microseconds
+from eca.timestamp import epoch
 import logging
 import re
 import sys
-from typing import List, Protocol
+from typing import Dict, List, Protocol, Sequence, Tuple
 
 logger = logging.getLogger("eca")
 logger.addHandler(logging.StreamHandler(sys.stdout))
@@ -23,13 +29,18 @@ class Parser(Protocol):
     def set_overlap(self, o: float):
         ...
 
+    @property
+    @abstractmethod
+    def overlap(self) -> float:
+        ...
+
     @abstractmethod
-    def __call__(self):
+    def __call__(self, s: str) -> int:
         ...
 
 class ParserFactory:
     class ISOParser:
-        """Finds an ISO date in the script and parses that as time."""
+        """Finds an ISO date in the script and parses that as epoch microseconds."""
         def __init__(self):
             self.re = re.compile(r'(?P<year>\d\d\d\d)-'
                                  r'(?P<month>\d\d)-'
@@ -44,24 +55,22 @@ class ParserFactory:
         def set_overlap(self, overlap):
             self._overlap = overlap
 
+        @property
+        def overlap(self) -> float:
+            return self._overlap
+
         def __call__(self, s: str):
             if not s:
                 return None
             match = self.re.search(s)
             if match:
-                if match.group('microseconds'):
-                    microseconds = int(1000000 * float("0." + match.group('microseconds')))
-                else:
-                    microseconds = 0
-
-                time = datetime(int(match.group('year')),
-                                int(match.group('month')),
-                                int(match.group('day')),
-                                int(match.group('hours')),
-                                int(match.group('minutes')),
-                                int(match.group('seconds')),
-                                microseconds)
-                return TimeSpan(time, timedelta(seconds=self._overlap))  # FIXME: configurable time span
+                return epoch(int(match.group('year')),
+                             int(match.group('month')),
+                             int(match.group('day')),
+                             int(match.group('hours')),
+                             int(match.group('minutes')),
+                             int(match.group('seconds')),
+                             microseconds(match.group('microseconds')))
             return None
 
     @staticmethod
@@ -71,77 +80,104 @@ class ParserFactory:
         else:
             raise RuntimeError(f"Unknown parser: {method}")
 
-
-class TimeSpan:
-    def __init__(self, t: datetime, d: timedelta):
-        self.time = t
-        self.duration = d
-
-    def is_coincident(self, other) -> bool:
-        s1 = self.time
-        s2 = self.time + self.duration
-        o1 = other.time
-        o2 = other.time + other.duration
-
-        return not ((o1 < s1 and o2 < s1) or (o1 > s2 and o2 > s2))
-
-def compare_files(files: List[str], parsers: List[Parser]) -> None:
-    line = [None] * 2
-    fin = [None] * 2
-    span = [None] * 2
-    do_read = [False] * 2
-    coincidents = 0
-    misses = 0
-    with open(files[0]) as fin[0], open(files[1]) as fin[1]:
-        while True:
-            for i in range(2):
-                span[i] = parsers[i](line[i])
-                if span[i] is None:
-                    do_read[i] = True
-
-            if span[0] and span[1]:
-                if span[0].is_coincident(span[1]):
-                    logger.info(f"conincidence at {span[0].time} <> {span[1].time}")
-                    coincidents += 1
-                    do_read[0] = do_read[1] = True
-                else:
-                    misses += 1
-
-                if span[0].time < span[1].time:
-                    do_read[0] = True
-                else:
-                    do_read[1] = True
-
-            for i in range(2):
-                if do_read[i]:
-                    line[i] = fin[i].readline().strip()
-                    do_read[i] = False
-
-            if line[0] == '' or line[1] == '':
-                break
-
-    return (coincidents, misses)
+def read_times(filename: str, parser: Parser, regex: str = None) -> array:
+    """
+    Return the sorted epoch microseconds of the lines in filename.
+
+    With a regex only matching lines are used and the time is parsed from the first group of the match, or
+    from the whole match if it has no groups.
+    """
+    pattern = re.compile(regex) if regex else None
+    times = list()
+    with open(filename) as fin:
+        for line in fin:
+            line = line.strip()
+            if pattern is not None:
+                match = pattern.search(line)
+                if not match:
+                    continue
+                line = match.group(1) if pattern.groups else match.group(0)
+            ts = parser(line)
+            if ts is not None:
+                times.append(ts)
+    times.sort()
+    return array('q', times)
+
+def match_times(a: Sequence[int], b: Sequence[int], margin_a: int, margin_b: int) -> Tuple[int, int]:
+    """
+    Return number of coincidents and misses between the sorted timestamps a and b.
+
+    An event at t of a spans [t, t + margin_a] and likewise for b, events coincide when their spans overlap.
+    Events are paired at most once, in time order, and every event passed over without a pair while both
+    lists have events left is a miss.
+    """
+    i, j = 0, 0
+    coincidents, misses = 0, 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j] - margin_a:
+            k = bisect_left(a, b[j] - margin_a, i)
+            misses += k - i
+            i = k
+        elif b[j] < a[i] - margin_b:
+            k = bisect_left(b, a[i] - margin_b, j)
+            misses += k - j
+            j = k
+        else:
+            logger.info(f"conincidence at {a[i]} <> {b[j]}")
+            coincidents += 1
+            i += 1
+            j += 1
+    return coincidents, misses
+
+def compare_files(files: List[str], parsers: List[Parser], regexes: List[str] = None,
+                  margin: float = None) -> Dict[Tuple[int, int], Tuple[int, int]]:
+    """
+    Compare every pair of files and return (coincidents, misses) by pair of file indexes (i, j), i < j.
+
+    The margin in seconds is used for all files, by default the overlap of the parser of each file is used.
+    """
+    times = [read_times(f, p, regexes[i] if regexes else None) for i, (f, p) in enumerate(zip(files, parsers))]
+    margins = [int((p.overlap if margin is None else margin) * 1000000) for p in parsers]
+    return {(i, j): match_times(times[i], times[j], margins[i], margins[j])
+            for i in range(len(files)) for j in range(i + 1, len(files))}
+
+def print_matrix(files: List[str], results: Dict[Tuple[int, int], Tuple[int, int]], out=sys.stdout) -> None:
+    """Print coincidents and misses of all file pairs as matrices."""
+    width = max(len(str(v)) for pair in results.values() for v in pair) + 2
+    for i, f in enumerate(files):
+        print(f"{i}: {f}", file=out)
+    for k, name in enumerate(("coincidents", "misses")):
+        print(f"\n{name}:", file=out)
+        print(" " * 4 + "".join(f"{j:>{width}}" for j in range(len(files))), file=out)
+        for i in range(len(files)):
+            cells = [results[min(i, j), max(i, j)][k] if i != j else "-" for j in range(len(files))]
+            print(f"{i:<4}" + "".join(f"{c:>{width}}" for c in cells), file=out)
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
 
     regex_default = r'^(.*)$'
+    files_desc = "Files after the second use the settings of the second file."
     regex_desc = f"Regular expression for selecting time and possible time range, defaults to {regex_default}"
     parser.add_argument("--regex1", default=regex_default, help=regex_desc)
-    parser.add_argument("--regex2", default=regex_default, help=regex_desc)
+    parser.add_argument("--regex2", default=regex_default, help=f"{regex_desc}. {files_desc}")
 
     format_default = "iso"
     format_desc = f"Format for parsing times from first file, default {format_default}. Either 'iso' or see pydoc time.strptime."
     parser.add_argument("--time-format1", default=format_default, help=format_desc)
-    parser.add_argument("--time-format2", default=format_default, help=format_desc)
+    parser.add_argument("--time-format2", default=format_default, help=f"{format_desc} {files_desc}")
 
-    parser.add_argument("--time-margin", default="10", help="number of seconds for time stamp to be considered coincident")
+    parser.add_argument("--time-margin", type=float,
+                        help="number of seconds for time stamp to be considered coincident, defaults to --overlap")
     parser.add_argument("-v", "--verbose", action="store_true")
     parser.add_argument("-o", "--overlap", default=1.0, type=float, help="How much overlaping time (in seconds) to work with.")
 
-    parser.add_argument("files", nargs=2, help="input files")
+    parser.add_argument("files", nargs="+", help="two or more input files")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if len(args.files) < 2:
+        parser.error("at least two files are needed")
+    return args
 
 def main():
     args = parse_arguments()
@@ -149,15 +185,21 @@ def main():
         logger.setLevel(logging.INFO)
 
     parsers = list()
+    regexes = list()
 
-    for i in range(2):
-        format = getattr(args, f"time_format{i+1}")
+    for i in range(len(args.files)):
+        format = getattr(args, f"time_format{min(i, 1) + 1}")
         p = ParserFactory.get_parser(format)
         p.set_overlap(args.overlap)
         parsers.append(p)
-
-    (coincidents, misses) = compare_files(args.files, parsers)
-    print(f"{coincidents} coincidents and {misses} misses")
+        regexes.append(getattr(args, f"regex{min(i, 1) + 1}"))
+
+    results = compare_files(args.files, parsers, regexes, args.time_margin)
+    if len(args.files) == 2:
+        (coincidents, misses) = results[0, 1]
+        print(f"{coincidents} coincidents and {misses} misses")
+    else:
+        print_matrix(args.files, results)
 
 
 if __name__ == "__main__":
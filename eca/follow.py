@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Live analysis of growing log files.
+
+Every source is tailed from where the previous round stopped, so each round only parses the bytes that
+were appended since. The events are fed to a StreamingAnalysis per incident group that keeps the counters
+up to date and the report is printed on an interval and whenever a new incident arrives.
+"""
+from datetime import timedelta
+import eca.config
+from eca.analysis import group_keys
+from eca.output import write_groups
+from eca.streaming import StreamingAnalysis, group_routes, tag_events
+import heapq
+import logging
+import os
+import sys
+import time
+from typing import List
+
+# Number of polls without new lines after which a source no longer holds back the others.
+IDLE_POLLS = 3
+
+# Number of lines held back at most, beyond it the oldest are passed on.
+MAX_HELD = 1000000
+
+class Follower:
+    """
+    Incremental reader of all sources of a config.
+
+    Lines are held back until every source has been read past them, the watermark, which is the oldest of
+    the latest timestamps read from each source, so lines of a source that is written to later are never
+    overtaken by the other sources. A source without any lines yet holds back everything. Lines are held
+    back for another tolerance to allow for out of order lines within a source, lines older than what has
+    already been passed on are dropped.
+
+    A source without new lines for idle_polls polls, typically a master with few incidents, no longer holds
+    back the others until it grows again, its lines older than the watermark by then are dropped. At most
+    max_held lines are held back, beyond that the oldest are passed on.
+    """
+    def __init__(self, config: eca.config.Config, tolerance: timedelta = timedelta(0),
+                 idle_polls: int = IDLE_POLLS, max_held: int = MAX_HELD):
+        self._sources = list(config.event_sources())
+        self._offsets = [0] * len(self._sources)
+        self._tolerance: int = tolerance // timedelta(microseconds=1)
+        self._idle_polls = idle_polls
+        self._max_held = max_held
+        self._capped = False
+        self._heap = list()
+        self._sequence = 0
+        # Latest timestamp read from each source, the number of polls since it grew and the oldest latest
+        # timestamp of the sources that are not idle.
+        self._latest: List[int] = [None] * len(self._sources)
+        self._idle: List[int] = [0] * len(self._sources)
+        self._watermark: int = None
+        self._released: int = None
+        # Analysis of every incident group, keyed by (category, group).
+        self.analyses = {key: StreamingAnalysis(config.range) for key in group_keys(config)}
+        self._routes = [[self.analyses[key] for key in keys] for keys in group_routes(self._sources, list(self.analyses))]
+        self.dropped = 0
+
+    def _release(self, until: int) -> int:
+        """Pass held back lines up to time until to the analysis and return the number of new incidents."""
+        incidents = 0
+        while self._heap and self._heap[0][0] <= until:
+            ts, kind, _, index, text = heapq.heappop(self._heap)
+            if self._released is not None and ts < self._released:
+                self.dropped += 1
+                logging.warning(f"{self._sources[index].filename}: dropping out of order line at {ts}")
+                continue
+            self._released = ts
+            if kind == 0:
+                for analysis in self._routes[index]:
+                    analysis.incident(ts)
+                incidents += 1
+            else:
+                text = self._sources[index].normalize(text)
+                for analysis in self._routes[index]:
+                    analysis.event(ts, text)
+        return incidents
+
+    def poll(self) -> int:
+        """Read everything appended since last poll and return the number of new incidents."""
+        streams = list()
+        for index, es in enumerate(self._sources):
+            if os.path.getsize(es.filename) < self._offsets[index]:
+                logging.warning(f"{es.filename}: file shrunk, reading it from the start")
+                self._offsets[index] = 0
+            start = self._offsets[index]
+            self._offsets[index] = es.complete_lines_end(start)
+            self._idle[index] = self._idle[index] + 1 if self._offsets[index] == start else 0
+            streams.append(tag_events(es.get_events(start, self._offsets[index]), 0 if es.is_master() else 1, index))
+
+        incidents = 0
+        # Sources that became idle no longer hold back the lines read before.
+        if self._update_watermark():
+            incidents += self._release(self._watermark - self._tolerance)
+        for ts, kind, index, text in heapq.merge(*streams):
+            self._sequence += 1
+            heapq.heappush(self._heap, (ts, kind, self._sequence, index, text))
+            if self._advance(index, ts):
+                incidents += self._release(self._watermark - self._tolerance)
+            elif len(self._heap) > self._max_held:
+                if not self._capped:
+                    logging.warning(f"more than {self._max_held} lines held back, passing on the oldest")
+                    self._capped = True
+                incidents += self._release(self._heap[0][0])
+        return incidents
+
+    def _advance(self, index: int, ts: int) -> bool:
+        """Update the latest timestamp of a source and return whether the watermark moved."""
+        latest = self._latest[index]
+        if latest is not None and ts <= latest:
+            return False
+        self._latest[index] = ts
+        if latest is not None and self._watermark is not None and latest > self._watermark:
+            return False
+        return self._update_watermark()
+
+    def _update_watermark(self) -> bool:
+        """Set the watermark from the sources that are not idle, or all if they are, and return whether it moved."""
+        active = [latest for latest, idle in zip(self._latest, self._idle) if idle < self._idle_polls]
+        if None in active:
+            return False
+        read = [latest for latest in self._latest if latest is not None]
+        if not read:
+            return False
+        watermark = min(active) if active else max(read)
+        if self._watermark is not None and watermark <= self._watermark:
+            return False
+        self._watermark = watermark
+        return True
+
+    @property
+    def held(self) -> int:
+        """Number of lines held back."""
+        return len(self._heap)
+
+    def finish(self) -> None:
+        """Pass on everything held back and classify all pending events, at end of input."""
+        if self._heap:
+            self._release(max(ts for ts, *_ in self._heap))
+        for analysis in self.analyses.values():
+            analysis.finish()
+
+def follow_sources(config: eca.config.Config, interval: float = 60.0, poll: float = 1.0,
+                   tolerance: timedelta = timedelta(0), format: str = "table", top: int = None,
+                   out=sys.stdout) -> None:
+    """
+    Tail all sources of config and write the report every interval seconds and on new incidents, in format
+    and only the top matched texts if given, as for eca.output.write_groups().
+    """
+    follower = Follower(config, tolerance)
+
+    def report_all():
+        analyses = follower.analyses
+        write_groups(config, {key: analysis.incidents for key, analysis in analyses.items()},
+                     {key: analysis.counters for key, analysis in analyses.items()}, format, top, out=out)
+
+    last_report = None
+    try:
+        while True:
+            incidents = follower.poll()
+            now = time.monotonic()
+            if incidents or last_report is None or now - last_report >= interval:
+                report_all()
+                out.flush()
+                last_report = now
+            time.sleep(poll)
+    except KeyboardInterrupt:
+        follower.finish()
+        report_all()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Statistics of metric values within and outside of the incident zones.
+
+A metric source is read once into an array('q') of timestamps and an array('d') of values, sorted on time.
+Every incident zone is then an index range of the samples, found by binary search, and the count, mean and
+deviation of each zone come from prefix sums of the values and their squares, without a loop over the
+samples. With NumPy the arrays are used in place and the percentiles of all samples within and outside of
+the zones are computed vectorized.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from eca.analysis import group_title
+import eca.config
+from eca.timestamp import TimestampDB
+from itertools import accumulate, compress
+import math
+import sys
+from typing import Dict, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Percentiles reported for the values within and outside of the incident zones.
+PERCENTILES = (50, 90, 99)
+
+class Summary:
+    """Number of samples, mean, standard deviation and PERCENTILES of a set of values."""
+    def __init__(self, count: int = 0, mean: float = None, std: float = None, percentiles: List[float] = None):
+        self.count = count
+        self.mean = mean
+        self.std = std
+        self.percentiles = percentiles or [None] * len(PERCENTILES)
+
+class Window:
+    """Count, mean and standard deviation of the samples within one incident zone, an open interval."""
+    def __init__(self, start: int, end: int, count: int, mean: float, std: float):
+        self.start = start
+        self.end = end
+        self.count = count
+        self.mean = mean
+        self.std = std
+
+class MetricStats:
+    """Statistics of a metric source against the incidents of a category."""
+    def __init__(self, filename: str, within: Summary, outside: Summary, windows: List[Window]):
+        self.filename = filename
+        self.within = within
+        self.outside = outside
+        self.windows = windows
+
+def _percentile(ordered: Sequence[float], percentile: float) -> float:
+    # Linear interpolation between closest ranks, as numpy.percentile() does by default.
+    position = (len(ordered) - 1) * percentile / 100
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def _summary(values) -> Summary:
+    if not len(values):
+        return Summary()
+    if np is not None:
+        return Summary(len(values), float(np.mean(values)), float(np.std(values)),
+                       [float(p) for p in np.percentile(values, PERCENTILES)])
+    mean = math.fsum(values) / len(values)
+    ordered = sorted(values)
+    return Summary(len(values), mean, math.sqrt(math.fsum((v - mean) ** 2 for v in values) / len(values)),
+                   [_percentile(ordered, p) for p in PERCENTILES])
+
+def _sort_samples(timestamps: array, values: array) -> Tuple[array, array]:
+    """Return the samples sorted on time, as they are when the source is sorted already."""
+    if np is not None:
+        ts = np.frombuffer(timestamps, dtype=np.int64)
+        if np.all(ts[1:] >= ts[:-1]):
+            return timestamps, values
+        order = np.argsort(ts, kind='stable')
+        return (array('q', ts[order].tobytes()),
+                array('d', np.frombuffer(values, dtype=np.float64)[order].tobytes()))
+    if all(a <= b for a, b in zip(timestamps, timestamps[1:])):
+        return timestamps, values
+    order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+    return array('q', (timestamps[i] for i in order)), array('d', (values[i] for i in order))
+
+def window_stats(filename: str, timestamps: array, values: array, incidents: TimestampDB) -> MetricStats:
+    """
+    Return the statistics of the samples, given as epoch timestamps and values sorted on time, within every
+    incident zone, within all zones together and outside of the zones in the applicable period.
+    """
+    zones = incidents.zones()
+    if not zones:
+        return MetricStats(filename, Summary(), Summary(), [])
+    starts = [start for start, _ in zones]
+    ends = [end for _, end in zones]
+
+    if np is not None:
+        ts = np.frombuffer(timestamps, dtype=np.int64)
+        vals = np.frombuffer(values, dtype=np.float64)
+        # Zones are open intervals, so samples at their start or end are outside.
+        first = np.searchsorted(ts, starts, side='right')
+        last = np.searchsorted(ts, ends, side='left')
+        sums = np.concatenate(([0.0], np.cumsum(vals)))
+        squares = np.concatenate(([0.0], np.cumsum(vals * vals)))
+        counts = last - first
+        total = sums[last] - sums[first]
+        total_squares = squares[last] - squares[first]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = total / counts
+            stds = np.sqrt(np.maximum(total_squares / counts - means * means, 0.0))
+        windows = [Window(*zone, int(n), float(m), float(s)) if n else Window(*zone, 0, None, None)
+                   for zone, n, m, s in zip(zones, counts, means, stds)]
+
+        # Mark the samples within zones by the difference of zone starts and ends, as zones are disjoint.
+        marks = np.zeros(len(ts) + 1, dtype=np.int64)
+        np.add.at(marks, first, 1)
+        np.add.at(marks, last, -1)
+        within = np.cumsum(marks[:-1]) > 0
+        low, high = first[0], last[-1]
+        return MetricStats(filename, _summary(vals[within]), _summary(vals[low:high][~within[low:high]]), windows)
+
+    first = [bisect_right(timestamps, start) for start in starts]
+    last = [bisect_left(timestamps, end) for end in ends]
+    sums = [0.0] + list(accumulate(values))
+    squares = [0.0] + list(accumulate(v * v for v in values))
+    windows = list()
+    within = [False] * len(timestamps)
+    for zone, i, j in zip(zones, first, last):
+        if i >= j:
+            windows.append(Window(*zone, 0, None, None))
+            continue
+        mean = (sums[j] - sums[i]) / (j - i)
+        std = math.sqrt(max((squares[j] - squares[i]) / (j - i) - mean * mean, 0.0))
+        windows.append(Window(*zone, j - i, mean, std))
+        within[i:j] = [True] * (j - i)
+    low, high = first[0], last[-1]
+    outside = list(compress(values[low:high], (not w for w in within[low:high])))
+    return MetricStats(filename, _summary(list(compress(values, within))), _summary(outside), windows)
+
+def metric_stats(config: eca.config.Config,
+                 groups: Dict[Tuple[str, str], TimestampDB]) -> Dict[Tuple[str, str], List[MetricStats]]:
+    """
+    Return the statistics of every metric source against the incidents of each group of its categories,
+    keyed by (category, group) as from collect_group_incidents().
+    """
+    results = {key: list() for key in groups}
+    for ms in config.metric_sources():
+        timestamps, values = _sort_samples(*ms.get_values())
+        for key, incidents in groups.items():
+            if key[0] in ms.categories:
+                results[key].append(window_stats(ms.filename, timestamps, values, incidents))
+    return results
+
+def _format(value: float) -> str:
+    return "-" if value is None else f"{value:.6g}"
+
+def report_metrics(config: eca.config.Config, groups: Dict[Tuple[str, str], TimestampDB], out=sys.stdout) -> None:
+    """Print the values of every metric source within and outside of the incident zones, per incident group."""
+    for key, results in metric_stats(config, groups).items():
+        if not results:
+            continue
+        title = group_title(groups, key)
+        print(file=out)
+        print(f"Metrics{f' of {title[:1].lower()}{title[1:]}' if title else ''}:", file=out)
+        header = "".join(f"{'p' + str(p):>12}" for p in PERCENTILES)
+        for stats in results:
+            print(f"{stats.filename}:", file=out)
+            print(f"{'':<8}{'samples':>10}{'mean':>12}{'std':>12}{header}", file=out)
+            for name, summary in (('within', stats.within), ('outside', stats.outside)):
+                percentiles = "".join(f"{_format(p):>12}" for p in summary.percentiles)
+                print(f"{name:<8}{summary.count:>10}{_format(summary.mean):>12}{_format(summary.std):>12}"
+                      f"{percentiles}", file=out)
+            means = [w.mean for w in stats.windows if w.count]
+            if means:
+                print(f"{len(means)} of {len(stats.windows)} incident zones have samples, zone means from "
+                      f"{_format(min(means))} to {_format(max(means))}.", file=out)
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
+from functools import lru_cache, partial
 import re
-from typing import Protocol
+from typing import Callable, Iterable, List, Pattern, Protocol, Tuple
+
+# Default number of normalized texts remembered per source.
+CACHE_SIZE = 65536
 
 class Normalizer(Protocol):
     normalizers = dict()
+    substitutions: List[Tuple[Pattern, str]] = []
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
@@ -14,48 +19,84 @@ class Normalizer(Protocol):
     def create_from_str(name: str):
         return Normalizer.normalizers[name]()
 
-    def normalize(sel, line: str) -> str:
-        ...
+    def normalize(self, line: str) -> str:
+        """Apply the (pattern, replacement) substitutions in order."""
+        for pattern, replacement in self.substitutions:
+            line = pattern.sub(replacement, line)
+        return line
 
 class NoDigits(Normalizer):
     tag = "no-digits"
-    _re = re.compile(r'\d+')
-
-    def normalize(self, line: str) -> str:
-        return self._re.sub('9', line)
+    substitutions = [(re.compile(r'\d+'), '9')]
 
 class NoPunctuation(Normalizer):
     tag = "no-punctuations"
-    _re = re.compile(r'[^\w\s]+')
-
-    def normalize(self, line: str) -> str:
-        return self._re.sub('_', line)
+    substitutions = [(re.compile(r'[^\w\s]+'), '_')]
 
 class NoChangeid(Normalizer):
     tag = "no-changeid"
-    _re = re.compile(r"\sI[0-9a-f]+\s")
-
-    def normalize(self, line: str) -> str:
-        return self._re.sub(' change-id ', line)
+    substitutions = [(re.compile(r"\sI[0-9a-f]+\s"), ' change-id ')]
 
 class NoJoltHash(Normalizer):
     tag = "no-jolt-hash"
-    _re1 = re.compile(r"\[[0-9a-f]+\]")
-    _re2 = re.compile(r"jolt-worker-[^-]+-[^-]+-[^-]+")
-
-    def normalize(self, line: str) -> str:
-        return self._re2.sub('jolt-worker-xxx', self._re1.sub('[jolt-hash]', line))
+    substitutions = [(re.compile(r"\[[0-9a-f]+\]"), '[jolt-hash]'),
+                     (re.compile(r"jolt-worker-[^-]+-[^-]+-[^-]+"), 'jolt-worker-xxx')]
 
 class NoUUID(Normalizer):
     tag = "no-uuid"
-    _re = re.compile(r"[0-9a-f]{8}-"
-                     r"[0-9a-f]{4}-"
-                     r"[0-9a-f]{4}-"
-                     r"[0-9a-f]{4}-"
-                     r"[0-9a-f]{12}")
-
-    def normalize(self, line: str) -> str:
-        return self._re.sub('UUID', line)
+    substitutions = [(re.compile(r"[0-9a-f]{8}-"
+                                 r"[0-9a-f]{4}-"
+                                 r"[0-9a-f]{4}-"
+                                 r"[0-9a-f]{4}-"
+                                 r"[0-9a-f]{12}"), 'UUID')]
+
+class NormalizerChain:
+    """
+    The normalizers of a source compiled into one function.
+
+    The substitutions of all normalizers are flattened into a single list of bound re.sub() calls, and
+    the resulting function is memoized by a bounded LRU cache keyed on the raw text, since logs tend to
+    repeat the same lines over and over. A cache_size of 0 disables the cache.
+    """
+    def __init__(self, normalizers: Iterable[Normalizer] = (), cache_size: int = CACHE_SIZE):
+        self._normalizers: List[Normalizer] = list(normalizers)
+        self._cache_size: int = cache_size
+        self._compile()
+
+    def _compile(self) -> None:
+        steps: List[Callable[[str], str]] = list()
+        for n in self._normalizers:
+            if type(n).normalize is Normalizer.normalize:
+                steps.extend(partial(pattern.sub, replacement) for pattern, replacement in n.substitutions)
+            else:
+                steps.append(n.normalize)
+
+        def normalize(line: str) -> str:
+            for step in steps:
+                line = step(line)
+            return line
+
+        if steps and self._cache_size:
+            normalize = lru_cache(maxsize=self._cache_size)(normalize)
+        self.normalize: Callable[[str], str] = normalize
+
+    def append(self, normalizer: Normalizer) -> None:
+        self._normalizers.append(normalizer)
+        self._compile()
+
+    def cache_info(self):
+        """Return functools cache statistics (hits, misses, maxsize, currsize) or None without cache."""
+        return self.normalize.cache_info() if hasattr(self.normalize, 'cache_info') else None
+
+    def __len__(self) -> int:
+        return len(self._normalizers)
+
+    def __getstate__(self):
+        return {'_normalizers': self._normalizers, '_cache_size': self._cache_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Structured output of matched texts, for reading by other tools.
+
+The writers take results as from eca.analysis.group_results() or eca.sweep.sweep_results(), dicts with the
+parameters of a report and its matches. JSON Lines and CSV have one row per match with the parameters
+repeated, so they can be streamed into other tools as they are. Rows are formatted into a buffer and written
+in batches.
+"""
+import csv
+from eca.analysis import group_results, report_groups
+import eca.config
+from eca.counters import TextCounters
+import io
+import json
+import sys
+from typing import Dict, Iterator, List, Tuple
+
+# Number of rows formatted before they are written.
+BATCH_SIZE = 4096
+
+def rows(results: List[dict]) -> Iterator[dict]:
+    """Return a row per match with the parameters of its result."""
+    for result in results:
+        parameters = {key: value for key, value in result.items() if key != 'matches'}
+        for match in result['matches']:
+            yield {**parameters, **match}
+
+def _fields(results: List[dict]) -> List[str]:
+    fields = dict.fromkeys(key for result in results for key in result if key != 'matches')
+    fields.update(dict.fromkeys(key for result in results for match in result['matches'] for key in match))
+    return list(fields)
+
+def write_json(results: List[dict], out=sys.stdout) -> None:
+    json.dump(results, out, indent=2)
+    print(file=out)
+
+def write_jsonl(results: List[dict], out=sys.stdout) -> None:
+    batch = list()
+    for row in rows(results):
+        batch.append(json.dumps(row))
+        if len(batch) >= BATCH_SIZE:
+            out.write("\n".join(batch) + "\n")
+            batch.clear()
+    if batch:
+        out.write("\n".join(batch) + "\n")
+
+def write_csv(results: List[dict], out=sys.stdout) -> None:
+    """Write the rows as CSV with a header line, fields missing from a row are empty."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=_fields(results), lineterminator="\n")
+    writer.writeheader()
+    for n, row in enumerate(rows(results), 1):
+        writer.writerow(row)
+        if n % BATCH_SIZE == 0:
+            out.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+    out.write(buffer.getvalue())
+
+
+WRITERS = {
+    'json': write_json,
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+}
+
+def write_groups(config: eca.config.Config, incidents: Dict[Tuple[str, str], int],
+                 counters: Dict[Tuple[str, str], TextCounters], format: str = "table", top: int = None,
+                 out=sys.stdout) -> None:
+    """Write the matched texts of every incident group as the text report, or in a format of WRITERS."""
+    if format == "table":
+        report_groups(config, incidents, counters, out=out, top=top)
+    else:
+        WRITERS[format](group_results(config, incidents, counters, top), out=out)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Analysis server that keeps the parsed and normalized events of a config in memory.
+
+The sources are read once, from the event cache when one is configured, into CachedEvents columns, and the
+incident times of the master sources into arrays. Queries then only classify and count the resident events,
+and their answers are kept in a least recently used result cache, so a repeated query costs a dictionary
+lookup.
+
+A query is a JSON object where every field is optional:
+
+    {"range": "2s", "percentile": 50, "accuracy": 80, "categories": ["main"], "sources": ["log1"],
+     "master": "incidents.log"}
+
+range, percentile and accuracy default to those of the config, range is given as in the config or as a
+number of seconds. categories restricts the answer to the
+incident groups of those categories. sources restricts the counted sources, given by filename as in the
+config or by base name. master restricts the answer to the incident groups of one master source of the
+config, given the same way, counted against the incidents of that source only. Other files are refused,
+so a query can not make the server read arbitrary paths. With a cluster-threshold in the config similar
+texts are merged like in the report. The answer has the matched texts per incident group like the JSON of
+--sweep, or an error message:
+
+    {"results": [{"category": "main", "group": null, "range": 2.0, ...,
+                  "matches": [{"text": ..., "within": 3, "outside": 0}]}]}
+
+Queries are served as one JSON object per line on a Unix socket, or over HTTP on localhost as the body of
+a POST or the parameters of a GET, where sources and categories are comma separated.
+"""
+from array import array
+from datetime import timedelta
+from eca.analysis import clustered, count_cached, group_keys, incident_times
+from eca.cache import CachedEvents, EventCache
+import eca.config
+from eca.counters import TextCounters
+from eca.sources import TextEvents
+from eca.timestamp import OUTSIDE, TimestampDB, WITHIN
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import os
+import socketserver
+import time
+from typing import List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# Number of query answers kept.
+RESULT_CACHE_SIZE = 256
+
+DEFAULT_PORT = 8351
+
+def _read_events(es: TextEvents) -> CachedEvents:
+    events = CachedEvents()
+    for ts, line in es.get_events():
+        events.append(ts, es.normalize(line))
+    return events
+
+def _index(sources: List[TextEvents], name: str, kind: str) -> int:
+    for i, es in enumerate(sources):
+        if name in (es.filename, os.path.basename(es.filename)) or \
+                os.path.abspath(name) == os.path.abspath(es.filename):
+            return i
+    raise ValueError(f"unknown {kind}: {name}")
+
+def _range(value) -> timedelta:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return timedelta(seconds=value)
+    if isinstance(value, str):
+        return eca.config.parse_range(value)
+    raise ValueError(f"range must be a number of seconds or like 1.5s: {value}")
+
+def _names(request: dict, field: str) -> List[str]:
+    names = request.get(field) or list()
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError(f"{field} must be a list of names")
+    return names
+
+class AnalysisServer:
+    """Resident events of the sources of a config, answering queries from them."""
+    def __init__(self, config: eca.config.Config, cache: EventCache = None,
+                 result_cache_size: int = RESULT_CACHE_SIZE):
+        self._config = config
+        started = time.perf_counter()
+        self._keys: List[Tuple[str, str]] = group_keys(config)
+        self._masters: List[TextEvents] = list(config.event_sources(master=True))
+        # Incident times of every master source and the keys of the incident groups they are in.
+        self._incidents: List[Tuple[List[Tuple[str, str]], array]] = [
+            ([key for key in self._keys if key[0] in es.categories and key[1] == es.group],
+             array('q', incident_times(es, cache))) for es in self._masters]
+        self._sources: List[Tuple[TextEvents, CachedEvents]] = [
+            (es, cache.load(es) if cache is not None else _read_events(es))
+            for es in config.event_sources(master=False)]
+        logging.info(f"loaded {sum(len(events) for _, events in self._sources)} events and "
+                     f"{sum(len(times) for _, times in self._incidents)} incidents in "
+                     f"{time.perf_counter() - started:.1f} s")
+        self._answer = lru_cache(maxsize=result_cache_size)(self._answer)
+
+    def query(self, request: dict) -> dict:
+        """Return the answer to a query, see the module description."""
+        unknown = set(request) - {'range', 'percentile', 'accuracy', 'categories', 'sources', 'master'}
+        if unknown:
+            raise ValueError(f"unknown query fields: {', '.join(sorted(unknown))}")
+        range_ = _range(request['range']) if request.get('range') else self._config.range
+        range_us = range_ // timedelta(microseconds=1)
+        percentile = int(request.get('percentile', self._config.percentile))
+        accuracy = int(request.get('accuracy', self._config.accuracy))
+        categories = tuple(_names(request, 'categories') or self._config.categories)
+        for category in categories:
+            if category not in self._config.categories:
+                raise ValueError(f"unknown category: {category}")
+        if _names(request, 'sources'):
+            sources = tuple(sorted({_index([es for es, _ in self._sources], name, "source")
+                                    for name in request['sources']}))
+        else:
+            sources = tuple(range(len(self._sources)))
+        if request.get('master') and not isinstance(request['master'], str):
+            raise ValueError("master must be a name")
+        master = _index(self._masters, request['master'], "master source") if request.get('master') else None
+        return self._answer(range_us, percentile, accuracy, categories, sources, master)
+
+    def _answer(self, range_us: int, percentile: int, accuracy: int, categories: Tuple[str, ...],
+                sources: Tuple[int, ...], master: int) -> dict:
+        started = time.perf_counter()
+        incidents = self._incidents if master is None else [self._incidents[master]]
+        results = list()
+        for category, group in (key for key in self._keys if key[0] in categories):
+            if master is not None and (category, group) not in incidents[0][0]:
+                continue
+            timestamps = TimestampDB(range=timedelta(microseconds=range_us))
+            for keys, times in incidents:
+                if (category, group) in keys:
+                    for ts in times:
+                        timestamps.append(ts)
+            counters = None
+            for i in sources:
+                es, events = self._sources[i]
+                if category in es.categories:
+                    part = count_cached(events, timestamps)
+                    if counters is None:
+                        counters = part
+                    else:
+                        counters.merge(part)
+            counters = clustered(self._config, counters) if counters is not None else TextCounters()
+            within, outside = counters.columns[WITHIN], counters.columns[OUTSIDE]
+            min_count = int((len(timestamps) * percentile) / 100)
+            results.append({
+                'category': category,
+                'group': group,
+                'range': range_us / 1000000,
+                'percentile': percentile,
+                'accuracy': accuracy,
+                'incidents': len(timestamps),
+                'matches': [{'text': counters.texts[i], 'within': within[i], 'outside': outside[i]}
+                            for i in counters.matches(min_count, accuracy)],
+            })
+        logging.info(f"answered query in {time.perf_counter() - started:.3f} s")
+        return {'results': results}
+
+    def respond(self, request) -> dict:
+        """Return the answer to a query, or an error message for a bad one."""
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("query must be a JSON object")
+            return self.query(request)
+        except (ValueError, TypeError, RuntimeError, OSError) as e:
+            return {'error': str(e)}
+
+def serve_unix(server: AnalysisServer, path: str) -> None:
+    """Answer queries of one JSON object per line on a Unix socket at path, until interrupted."""
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    answer = server.respond(json.loads(line))
+                except ValueError as e:
+                    answer = {'error': f"invalid JSON: {e}"}
+                self.wfile.write(json.dumps(answer).encode() + b'\n')
+                self.wfile.flush()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.UnixStreamServer(path, Handler) as unix_server:
+        logging.warning(f"serving queries on {path}")
+        try:
+            unix_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+
+def serve_http(server: AnalysisServer, port: int = DEFAULT_PORT, host: str = "127.0.0.1") -> None:
+    """Answer queries over HTTP on host and port, until interrupted."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            request = dict()
+            for name, values in parse_qs(urlparse(self.path).query).items():
+                request[name] = values[-1].split(',') if name in ('sources', 'categories') else values[-1]
+            self._reply(server.respond(request))
+
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            except ValueError as e:
+                self._reply({'error': f"invalid JSON: {e}"})
+                return
+            self._reply(server.respond(request))
+
+        def _reply(self, answer: dict):
+            body = json.dumps(answer).encode()
+            self.send_response(400 if 'error' in answer else 200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.info(format % args)
+
+    with HTTPServer((host, port), Handler) as http_server:
+        logging.warning(f"serving queries on http://{host}:{port}/")
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
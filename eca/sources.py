@@ -1,33 +1,439 @@
 #!/usr/bin/env python3
-from datetime import datetime
-from typing import List, Tuple, Iterator
-from eca.normalizer import Normalizer
+from array import array
+import bz2
+import glob
+import gzip
+import io
+import logging
+import lzma
+import mmap
+import os
+import queue
+import re
+import threading
+from typing import Callable, Dict, List, Tuple, Iterator
+from eca.normalizer import CACHE_SIZE, Normalizer, NormalizerChain
 from eca.dateparser import DateParser
+from eca.stats import SourceStats
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Default size of the read buffer used when streaming log files.
+BUFFER_SIZE = 1024 * 1024
+
+# Number of bytes at the start of a line that are decoded to find its timestamp when scanning.
+PREFIX_SIZE = 64
+
+# Number of decompressed blocks of buffer size that are read ahead of the parser.
+READ_AHEAD = 4
+
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.lzma': 'xz', '.zst': 'zstd'}
+
+_MAGIC = [(re.compile(rb'\x1f\x8b'), 'gzip'), (re.compile(rb'BZh[1-9]'), 'bz2'), (re.compile(rb'\xfd7zXZ\x00'), 'xz'),
+          (re.compile(rb'\x28\xb5\x2f\xfd'), 'zstd')]
+
+def detect_compression(filename: str) -> str:
+    """Return gzip, bz2, xz or zstd from the extension or else the magic bytes of filename, or None."""
+    compression = COMPRESSION_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if compression is not None:
+        return compression
+    try:
+        with open(filename, "rb") as fin:
+            head = fin.read(6)
+    except OSError:
+        return None
+    return next((name for magic, name in _MAGIC if magic.match(head)), None)
+
+def _open_compressed(filename: str, compression: str):
+    if compression == 'gzip':
+        return gzip.open(filename, "rb")
+    if compression == 'bz2':
+        return bz2.open(filename, "rb")
+    if compression == 'xz':
+        return lzma.open(filename, "rb")
+    if zstandard is None:
+        raise RuntimeError(f"{filename}: reading zstd compressed files needs zstandard, pip install .[zstd]")
+    return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True)
+
+class DecompressedLines:
+    """
+    Lines of a compressed file, decompressed by a background thread.
+
+    The thread stays at most READ_AHEAD blocks ahead of the reader, so memory use is bounded. zlib, bz2, lzma
+    and zstandard release the GIL while decompressing, so decompression overlaps with parsing the lines.
+    """
+    def __init__(self, filename: str, compression: str, block_size: int = BUFFER_SIZE):
+        self._blocks = queue.Queue(maxsize=READ_AHEAD)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, args=(filename, compression, block_size),
+                                        name=f"decompress {filename}", daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self, filename: str, compression: str, block_size: int) -> None:
+        try:
+            with _open_compressed(filename, compression) as fin:
+                while True:
+                    block = fin.read(block_size)
+                    if not self._put(block) or not block:
+                        return
+        except Exception as e:
+            self._put(e)
+
+    def __iter__(self) -> Iterator[bytes]:
+        rest = b''
+        while True:
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                break
+            block = rest + block
+            end = block.rfind(b'\n') + 1
+            yield from io.BytesIO(block[:end])
+            rest = block[end:]
+        if rest:
+            yield rest
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self) -> "DecompressedLines":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _rotation_key(filename: str) -> Tuple[int, int, str]:
+    # Rotated files are numbered from newest to oldest, like app.log.2.gz, app.log.1.gz and app.log.
+    number = re.search(r'\.(\d+)(\.[a-z0-9]+)?$', filename)
+    return os.stat(filename).st_mtime_ns, -int(number.group(1)) if number else 0, filename
+
+def expand_filename(pattern: str) -> List[str]:
+    """
+    Return the files a source filename stands for, oldest first: the file itself, the files in a directory
+    or the files matching a glob pattern.
+
+    Files are ordered on modification time and then rotation number, so that rotated logs are in time order.
+    """
+    if os.path.isdir(pattern):
+        files = [os.path.join(pattern, name) for name in os.listdir(pattern) if not name.startswith('.')]
+    elif re.search(r'[*?[]', pattern):
+        files = glob.glob(pattern)
+    else:
+        return [pattern]
+    files = [f for f in files if os.path.isfile(f)]
+    if not files:
+        raise RuntimeError(f"no files found for source: {pattern}")
+    return sorted(files, key=_rotation_key)
 
 class TextEvents:
     """Source of text based events."""
-    def __init__(self, filename, date_parser, master):
+    def __init__(self, filename, date_parser, master, encoding="utf-8", errors="replace", buffer_size=BUFFER_SIZE,
+                 cache_size=CACHE_SIZE, signature=None, use_mmap=False, time_sorted=False,
+                 categories=('main',), group=None):
         self._filename: str = filename
         self._date_parser: DateParser = date_parser
         self._master: bool = master
-        self._normalizers: List[Normalizer] = []
+        self._normalizers: NormalizerChain = NormalizerChain(cache_size=cache_size)
+        self._encoding: str = encoding
+        self._errors: str = errors
+        self._buffer_size: int = buffer_size
+        self._use_mmap: bool = use_mmap
+        self._time_sorted: bool = time_sorted
+        self._categories: List[str] = list(categories)
+        self._group: str = group
+        self._compression: str = detect_compression(filename)
+        if self._compression is not None and (use_mmap or time_sorted):
+            logging.warning(f"{filename}: {self._compression} compressed files are read in full, "
+                            f"ignoring mmap and sorted")
+            self._use_mmap = self._time_sorted = False
+        # Lines of a parser that rolls over at midnight are dated by the lines before them.
+        self._sequential: bool = getattr(date_parser, 'rolls_over', False)
+        if self._sequential and time_sorted:
+            logging.warning(f"{filename}: date-format has no date, ignoring sorted")
+            self._time_sorted = False
+        # Description of how events are parsed and normalized, used as key for cached events.
+        self.signature: str = signature
+        self.stats: SourceStats = SourceStats()
 
     def add_normalizer(self, normalizer: Normalizer) -> None:
         self._normalizers.append(normalizer)
 
     def normalize(self, line: str) -> str:
-        for n in self._normalizers:
-            line = n.normalize(line)
-        return line
+        return self._normalizers.normalize(line)
+
+    def normalizer_cache_info(self):
+        """Return hit/miss statistics of the normalizer cache, or None if there is no cache."""
+        return self._normalizers.cache_info()
+
+    def parser_hits(self) -> Dict[str, int]:
+        """Return the number of lines parsed by each parser, for date parsers that try several."""
+        parser = self._date_parser
+        while hasattr(parser, 'parser'):
+            parser = parser.parser
+        return parser.hits_by_parser() if hasattr(parser, 'hits_by_parser') else dict()
+
+    def parser_state(self):
+        """Return the state a date parser that rolls over at midnight is left in, None for other parsers."""
+        return self._date_parser.state() if self._sequential else None
+
+    def restore_parser_state(self, state) -> None:
+        """Continue parsing after the lines that left the date parser in state, see parser_state()."""
+        if self._sequential and state is not None:
+            self._date_parser.restore(tuple(state))
 
     def is_master(self) -> bool:
         return self._master
 
-    def get_events(self) -> Iterator[Tuple[datetime, str]]:
-        with open(self._filename) as fin:
-            for line in fin.readlines():
-                line = line.strip()
-                res = self._date_parser.process(line)
-                if res[0]:
-                    yield res
+    @property
+    def filename(self) -> str:
+        return self._filename
+
+    @property
+    def categories(self) -> List[str]:
+        """Categories the source is counted in, or for a master source, the categories its incidents apply to."""
+        return self._categories
+
+    @property
+    def group(self) -> str:
+        """Incident group of a master source, or None when its incidents are not in a group."""
+        return self._group
+
+    @property
+    def compression(self) -> str:
+        """Compression of the file, gzip, bz2, xz or zstd, or None for plain text."""
+        return self._compression
+
+    @property
+    def use_mmap(self) -> bool:
+        """True if the source should be read with scan_events()."""
+        return self._use_mmap
+
+    @property
+    def time_sorted(self) -> bool:
+        """True if the lines of the source are sorted on time, so that it can be searched with seek()."""
+        return self._time_sorted
+
+    def byte_ranges(self, size: int, start: int = 0, end: int = None) -> List[Tuple[int, int]]:
+        """
+        Split the file, or the part from start to end, at line boundaries into (start, end) byte ranges of
+        about size bytes.
+
+        A compressed file can not be split and is a single range of its whole compressed size, neither can a
+        file with time only timestamps, which are dated by the lines before them.
+        """
+        total = os.path.getsize(self._filename) if end is None else end
+        if self._compression is not None or self._sequential:
+            return [(start, total)] if start < total else []
+        ranges = list()
+        with open(self._filename, "rb") as fin:
+            while start < total:
+                fin.seek(start + size)
+                fin.readline()
+                end = min(fin.tell(), total)
+                ranges.append((start, end))
+                start = end
+        return ranges
+
+    @staticmethod
+    def _line_start(fin, pos: int) -> int:
+        """Return the offset of the first line starting at or after pos."""
+        if pos == 0:
+            return 0
+        fin.seek(pos - 1)
+        fin.readline()
+        return fin.tell()
+
+    def _next_timestamp(self, fin, pos: int, end: int) -> Tuple[int, int]:
+        """Return offset and timestamp of the first line with a timestamp starting at or after pos, before end."""
+        offset = self._line_start(fin, pos)
+        while offset < end:
+            raw = fin.readline()
+            if not raw:
+                break
+            ts = self._date_parser.process(raw.decode(self._encoding, self._errors).strip())[0]
+            if ts is not None:
+                return offset, ts
+            offset += len(raw)
+        return end, None
+
+    def seek(self, timestamp: int) -> int:
+        """
+        Return the offset of the first line with a timestamp at or after timestamp, or the file size if
+        there is none.
+
+        The file must be sorted on time. The search bisects byte offsets and resynchronizes to the next line
+        at every step, so only about log2(file size) lines are parsed.
+        """
+        with open(self._filename, "rb") as fin:
+            low, high = 0, os.fstat(fin.fileno()).st_size
+            while low < high:
+                mid = (low + high) // 2
+                offset, ts = self._next_timestamp(fin, mid, high)
+                if ts is None or ts >= timestamp:
+                    high = mid
+                else:
+                    low = offset + 1
+            return self._line_start(fin, low)
+
+    def complete_lines_end(self, start: int = 0) -> int:
+        """
+        Return the offset just after the last complete, newline terminated, line after start.
+
+        Compressed files are not written to while read, so their end is the file size.
+        """
+        if self._compression is not None:
+            return os.path.getsize(self._filename)
+        with open(self._filename, "rb") as fin:
+            end = fin.seek(0, os.SEEK_END)
+            while end > start:
+                block = max(start, end - self._buffer_size)
+                fin.seek(block)
+                newline = fin.read(end - block).rfind(b'\n')
+                if newline >= 0:
+                    return block + newline + 1
+                end = block
+        return start
+
+    def get_events(self, start: int = 0, end: int = None) -> Iterator[Tuple[int, str]]:
+        """
+        Stream (epoch-microseconds, text) events from the file.
+
+        The file is read in binary with a bounded buffer and each line is decoded on its own, so memory use
+        does not depend on file size and undecodable bytes are handled according to the errors setting.
+        Reading can be limited to the lines in the byte range start to end, see byte_ranges().
+
+        Compressed files are decompressed while reading by DecompressedLines. They are always read as a whole,
+        as the single byte range from 0 to their size, and nothing is read from any other start.
+        """
+        if self._compression is not None:
+            if start > 0:
+                return
+            end = None
+        self._reset_parser(start)
+        lines, misses, pos = 0, 0, start
+        try:
+            with self._open_lines(start) as fin:
+                for raw in fin:
+                    if end is not None and pos >= end:
+                        break
+                    pos += len(raw)
+                    lines += 1
+                    line = raw.decode(self._encoding, self._errors).strip()
+                    res = self._date_parser.process(line)
+                    if res[0] is not None:
+                        yield res
+                    else:
+                        misses += 1
+        finally:
+            self.stats.read(lines, pos - start, misses)
+
+    def _reset_parser(self, start: int) -> None:
+        # Reading from the start again, or continuing after the lines read before.
+        if start == 0 and hasattr(self._date_parser, 'reset'):
+            self._date_parser.reset()
+
+    def _open_lines(self, start: int):
+        """Return a context manager iterating over the raw lines of the file from start."""
+        if self._compression is not None:
+            return DecompressedLines(self._filename, self._compression, self._buffer_size)
+        fin = open(self._filename, "rb", buffering=self._buffer_size)
+        fin.seek(start)
+        return fin
+
+    def _parse_prefix(self, mm, pos: int, stop: int) -> Tuple[int, str, int]:
+        """
+        Return (epoch-microseconds, text, cut) parsed from the start of the line from pos to stop, where the
+        text of the line is text followed by the bytes from cut on, or None when the line has to be parsed
+        in full.
+        """
+        head = mm[pos:pos + PREFIX_SIZE]
+        # Cut the prefix at a space so that a timestamp is never parsed from part of a field. The rest of
+        # the line has to end in text, as the whole line is stripped.
+        space = head.rfind(b' ')
+        if space <= 0 or not mm[max(pos + space, stop - 8):stop].strip():
+            return None
+        ts, text = self._date_parser.process(head[:space].decode(self._encoding, self._errors).lstrip())
+        return (ts, text, pos + space) if ts is not None else None
+
+    def scan_events(self, applicable: Callable[[int], bool], start: int = 0,
+                    end: int = None) -> Iterator[Tuple[int, str]]:
+        """
+        Stream (epoch-microseconds, text) events from a memory map of the file, with text None for events
+        where applicable(timestamp) is false.
+
+        Line boundaries are found with find() on the map and the timestamp is parsed from a short decoded
+        prefix of each line. Only lines with an applicable timestamp are decoded in full, and appended to the
+        text of the prefix. When the prefix holds no timestamp the whole line is parsed instead. Byte ranges
+        work as for get_events().
+        """
+        self._reset_parser(start)
+        lines, misses, pos = 0, 0, start
+        try:
+            with open(self._filename, "rb") as fin:
+                size = os.fstat(fin.fileno()).st_size
+                if end is None or end > size:
+                    end = size
+                if start >= end:
+                    return
+                with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    while pos < end:
+                        newline = mm.find(b'\n', pos)
+                        stop = size if newline < 0 else newline + 1
+                        lines += 1
+                        res = self._parse_prefix(mm, pos, stop) if stop - pos > PREFIX_SIZE else None
+                        if res is not None:
+                            ts, text, cut = res
+                            if applicable(ts):
+                                yield ts, text + mm[cut:stop].decode(self._encoding, self._errors).rstrip()
+                            else:
+                                yield ts, None
+                        else:
+                            res = self._date_parser.process(mm[pos:stop].decode(self._encoding, self._errors).strip())
+                            if res[0] is not None:
+                                yield res if applicable(res[0]) else (res[0], None)
+                            else:
+                                misses += 1
+                        pos = stop
+        finally:
+            self.stats.read(lines, pos - start, misses)
+
+class MetricValues(TextEvents):
+    """Source of continuous values, with a line "timestamp value" per sample."""
+    def __init__(self, filename, date_parser, encoding="utf-8", errors="replace", buffer_size=BUFFER_SIZE,
+                 categories=('main',)):
+        super().__init__(filename, date_parser, master=False, encoding=encoding, errors=errors,
+                         buffer_size=buffer_size, cache_size=0, categories=categories)
+
+    def get_values(self) -> Tuple[array, array]:
+        """
+        Return the epoch-microseconds timestamps and the values of all samples, as array('q') and array('d').
+
+        The value is the first word after the timestamp, lines without a number there are skipped.
+        """
+        timestamps, values = array('q'), array('d')
+        skipped = 0
+        for ts, text in self.get_events():
+            try:
+                values.append(float(text.split(None, 1)[0]))
+            except (IndexError, ValueError):
+                skipped += 1
+                continue
+            timestamps.append(ts)
+        if skipped:
+            logging.warning(f"{self.filename}: skipped {skipped} lines without a value")
+        return timestamps, values
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Counters and timings of an analysis run, printed with --stats.
+
+Every source keeps a SourceStats that the readers and the counting update per chunk or per read, not per
+line, so keeping statistics costs close to nothing whether they are printed or not.
+"""
+import cProfile
+from contextlib import contextmanager
+import io
+import pstats
+import sys
+import time
+from typing import Dict, Iterator, List
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class SourceStats:
+    """Lines and bytes read, parse misses and time spent per stage for one source."""
+    def __init__(self):
+        self.lines: int = 0
+        self.bytes: int = 0
+        self.misses: int = 0
+        self.parsers: Dict[str, int] = dict()
+        self.normalize_seconds: float = 0.0
+        self.classify_seconds: float = 0.0
+        # Bytes the peak resident memory of the process grew by while the source was read, the largest of
+        # any worker process.
+        self.peak_growth: int = None
+
+    def read(self, lines: int, size: int, misses: int) -> None:
+        self.lines += lines
+        self.bytes += size
+        self.misses += misses
+
+    def merge(self, other: "SourceStats") -> None:
+        """Add the counters of other, like those of a worker process that read part of the source."""
+        self.read(other.lines, other.bytes, other.misses)
+        for name, hits in other.parsers.items():
+            self.parsers[name] = self.parsers.get(name, 0) + hits
+        self.normalize_seconds += other.normalize_seconds
+        self.classify_seconds += other.classify_seconds
+        if other.peak_growth is not None:
+            self.peak_growth = max(self.peak_growth or 0, other.peak_growth)
+
+def peak_memory(children: bool = False) -> int:
+    """Return peak resident memory in bytes of this process, or of its finished child processes."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Linux reports kilobytes, macOS bytes.
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+@contextmanager
+def measured_peak(stats: SourceStats) -> Iterator[None]:
+    """Record in stats how much the block raised the peak resident memory of this process."""
+    before = peak_memory()
+    try:
+        yield
+    finally:
+        if before is not None:
+            stats.peak_growth = max(stats.peak_growth or 0, peak_memory() - before)
+
+class Stages:
+    """Wall time per stage of a run."""
+    def __init__(self):
+        self.seconds: Dict[str, float] = dict()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+@contextmanager
+def profiled(filename: str = None) -> Iterator[cProfile.Profile]:
+    """Profile the block with cProfile and dump the statistics to filename, if given."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if filename:
+            profile.dump_stats(filename)
+
+def _mib(size: int) -> str:
+    return "-" if size is None else f"{size / (1024 * 1024):.1f}"
+
+def print_stats(sources: List, stages: Stages, profile: cProfile.Profile = None, out=sys.stderr) -> None:
+    """
+    Print the statistics of the sources, the stage timings, peak memory and the top of a profile. The peak
+    memory of a source is how much it raised the peak of the process that read it.
+    """
+    print("Statistics:", file=out)
+    width = max([len(es.filename) for es in sources] + [6])
+    print(f"{'source':<{width}} {'lines':>10} {'bytes':>12} {'misses':>8} {'normalize s':>11} {'classify s':>10} "
+          f"{'peak +MiB':>9}", file=out)
+    for es in sources:
+        s = es.stats
+        print(f"{es.filename:<{width}} {s.lines:>10} {s.bytes:>12} {s.misses:>8} {s.normalize_seconds:>11.3f} "
+              f"{s.classify_seconds:>10.3f} {_mib(s.peak_growth):>9}", file=out)
+    for es in sources:
+        # Hits of worker processes are in the stats, those of this process still in the parser.
+        parsers = dict(es.stats.parsers)
+        for name, count in es.parser_hits().items():
+            parsers[name] = parsers.get(name, 0) + count
+        if parsers:
+            hits = ", ".join(f"{name} {count}" for name, count in parsers.items() if count)
+            print(f"{es.filename}: parser hits {hits}", file=out)
+    print("stages: " + ", ".join(f"{name} {seconds:.3f} s" for name, seconds in stages.seconds.items()), file=out)
+    print(f"peak memory: {_mib(peak_memory())} MiB, worker processes {_mib(peak_memory(children=True))} MiB",
+          file=out)
+    if profile is not None:
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(20)
+        print(text.getvalue(), file=out)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Single pass analysis of time sorted sources.
+
+All sources, master and non master, are merged by timestamp into one stream. Incidents are kept in a
+sliding window that only spans the range around the events waiting for classification, so memory use
+depends on the window rather than on the number of incidents and the input may be unbounded. Every
+incident group, as in eca.analysis.collect_group_incidents(), has an analysis of its own, fed with the
+incidents of its master sources and the events of the sources of its category.
+"""
+from collections import deque
+from datetime import timedelta
+from eca.analysis import group_keys
+import eca.config
+from eca.counters import TextCounters
+from eca.sources import TextEvents
+from eca.timestamp import NOT_APPLICABLE, OUTSIDE, WITHIN
+import heapq
+import logging
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+def reorder(events: Iterable[Tuple[int, str]], tolerance: int, name: str = "") -> Iterator[Tuple[int, str]]:
+    """
+    Return events sorted on time, buffering up to tolerance microseconds of out of order lines.
+
+    Events older than what has already been returned are reported and dropped. The number of dropped events
+    is available through the dropped attribute of the returned iterator.
+    """
+    return _Reorder(events, tolerance, name)
+
+class _Reorder:
+    def __init__(self, events: Iterable[Tuple[int, str]], tolerance: int, name: str):
+        self._events = iter(events)
+        self._tolerance = tolerance
+        self._name = name
+        self.dropped = 0
+
+    def __iter__(self):
+        heap = list()
+        latest = None
+        last = None
+        for n, (ts, text) in enumerate(self._events):
+            if last is not None and ts < last:
+                self.dropped += 1
+                logging.warning(f"{self._name}: dropping out of order line at {ts}, "
+                                f"{last - ts} us older than an earlier line")
+                continue
+            latest = ts if latest is None else max(latest, ts)
+            heapq.heappush(heap, (ts, n, text))
+            while heap and heap[0][0] <= latest - self._tolerance:
+                last, _, text = heapq.heappop(heap)
+                yield last, text
+        while heap:
+            ts, _, text = heapq.heappop(heap)
+            yield ts, text
+
+class StreamingAnalysis:
+    """
+    Classifies a time ordered stream of incidents and events.
+
+    An event at ts is classified when the stream has passed ts + range, since no later incident can affect it
+    then. Events after the zone of the latest incident are kept aside per text until either a later incident
+    makes them outside or the stream ends and they turn out not applicable.
+    """
+    def __init__(self, range: timedelta):
+        self._range: int = range // timedelta(microseconds=1)
+        self._window = deque()
+        self._pending = deque()
+        self._tail = TextCounters()
+        self._youngest: int = None
+        self._oldest: int = None
+        self.incidents: int = 0
+        self.counters = TextCounters()
+
+    def _classify_until(self, now: int) -> None:
+        """Classify pending events whose zone can no longer change at time now."""
+        pending, window, columns = self._pending, self._window, self.counters.columns
+        while pending and pending[0][0] + self._range <= now:
+            ts, text = pending.popleft()
+            while window and window[0] <= ts - self._range:
+                window.popleft()
+            if window:
+                columns[WITHIN][self.counters.intern(text)] += 1
+            elif self._youngest is None or ts <= self._oldest - self._range:
+                columns[NOT_APPLICABLE][self.counters.intern(text)] += 1
+            elif ts < self._youngest + self._range:
+                columns[OUTSIDE][self.counters.intern(text)] += 1
+            else:
+                self._tail.add(text, NOT_APPLICABLE)
+
+    def _flush_tail(self, zone: int) -> None:
+        column = self._tail.columns[NOT_APPLICABLE]
+        for i, text in enumerate(self._tail.texts):
+            self.counters.add(text, zone, column[i])
+        self._tail = TextCounters()
+
+    def incident(self, ts: int) -> None:
+        self._classify_until(ts)
+        if len(self._tail):
+            self._flush_tail(OUTSIDE)
+        self._window.append(ts)
+        self._youngest = ts
+        if self._oldest is None:
+            self._oldest = ts
+        self.incidents += 1
+
+    def event(self, ts: int, text: str) -> None:
+        self._classify_until(ts)
+        self._pending.append((ts, text))
+
+    def finish(self) -> TextCounters:
+        """Classify everything still pending, at end of input."""
+        while self._pending:
+            self._classify_until(self._pending[-1][0] + self._range)
+        self._flush_tail(NOT_APPLICABLE)
+        return self.counters
+
+def tag_events(events: Iterable[Tuple[int, str]], kind: int, index: int) -> Iterator[Tuple[int, int, int, str]]:
+    # Incidents, kind 0, sort before events with the same timestamp.
+    for ts, text in events:
+        yield ts, kind, index, text
+
+def group_routes(sources: List[TextEvents],
+                 keys: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """
+    Return for every source the keys of the incident groups its lines go to, the groups of the master source
+    in its categories or every group of the categories of other sources.
+    """
+    return [[key for key in keys if key[0] in es.categories and (not es.is_master() or key[1] == es.group)]
+            for es in sources]
+
+def stream_sources(config: eca.config.Config,
+                   tolerance: timedelta = timedelta(0)) -> Tuple[Dict[Tuple[str, str], StreamingAnalysis], int]:
+    """
+    Analyze all sources of config in one k-way merge on time.
+
+    Returns the analysis of every incident group, keyed by (category, group), and the number of out of order
+    lines that were dropped.
+    """
+    tolerance_us = tolerance // timedelta(microseconds=1)
+    sources = list(config.event_sources())
+    ordered = [reorder(es.get_events(), tolerance_us, es.filename) for es in sources]
+    streams = [tag_events(events, 0 if es.is_master() else 1, index)
+               for index, (es, events) in enumerate(zip(sources, ordered))]
+
+    analyses = {key: StreamingAnalysis(config.range) for key in group_keys(config)}
+    routes = [[analyses[key] for key in keys] for keys in group_routes(sources, list(analyses))]
+    for ts, kind, index, text in heapq.merge(*streams):
+        if kind == 0:
+            for analysis in routes[index]:
+                analysis.incident(ts)
+        else:
+            text = sources[index].normalize(text)
+            for analysis in routes[index]:
+                analysis.event(ts, text)
+    for analysis in analyses.values():
+        analysis.finish()
+    return analyses, sum(events.dropped for events in ordered)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep over range, percentile and accuracy from a single pass over the sources.
+
+An event is within the incident zones of range r when its distance to the nearest incident is below r, and
+applicable when its distance to the period spanned by the incidents is. Both distances are bucketed on the
+sorted grid of ranges, so two histograms per text over the grid give its within, outside and not
+applicable counts for every range. Percentile and accuracy only filter those counts, so the whole grid is
+reported without reading the logs again.
+"""
+from array import array
+from bisect import bisect_right
+from datetime import timedelta
+import eca.config
+from eca.analysis import CHUNK_SIZE, chunks, collect_group_incidents, escape
+from eca.cache import EventCache
+from eca.counters import TextCounters
+from eca.sources import TextEvents
+from eca.stats import measured_peak
+from eca.timestamp import OUTSIDE, TimestampDB, WITHIN
+import sys
+from typing import Dict, Iterator, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class SweepCounters:
+    """
+    Per text histograms of the distances of its events to the incidents, bucketed on a grid of ranges.
+
+    Bucket j counts events whose distance is at least ranges[j - 1] and below ranges[j], the last bucket
+    holds events at least as far away as the largest range.
+    """
+    def __init__(self, ranges: List[int]):
+        self.ranges = ranges
+        self._ids: Dict[str, int] = dict()
+        self.texts: List[str] = list()
+        # Indexed by bucket, of the distance to the nearest incident and to the incident period.
+        self.nearest = [array('q') for _ in range(len(ranges) + 1)]
+        self.period = [array('q') for _ in range(len(ranges) + 1)]
+
+    def intern(self, text: str) -> int:
+        i = self._ids.get(text)
+        if i is None:
+            i = self._ids[text] = len(self.texts)
+            self.texts.append(text)
+            for column in self.nearest + self.period:
+                column.append(0)
+        return i
+
+    def add(self, i: int, nearest: int, period: int) -> None:
+        self.nearest[nearest][i] += 1
+        self.period[period][i] += 1
+
+    def counters(self) -> Iterator[Tuple[int, TextCounters]]:
+        """Return (range, counters) for every range of the grid, in increasing order."""
+        size = len(self.texts)
+        within, applicable = array('q', bytes(8 * size)), array('q', bytes(8 * size))
+        total = array('q', bytes(8 * size))
+        for column in self.period:
+            for i, count in enumerate(column):
+                total[i] += count
+        for j, range_us in enumerate(self.ranges):
+            for i in range(size):
+                within[i] += self.nearest[j][i]
+                applicable[i] += self.period[j][i]
+            outside = array('q', (a - w for a, w in zip(applicable, within)))
+            not_applicable = array('q', (t - a for t, a in zip(total, applicable)))
+            yield range_us, TextCounters.from_columns(self.texts, (not_applicable, outside, array('q', within)))
+
+def _bucket(ranges: List[int], distances: List[int]) -> List[int]:
+    if np is not None:
+        return np.searchsorted(np.asarray(ranges, dtype=np.int64), np.asarray(distances, dtype=np.int64),
+                               side='right').tolist()
+    return [bisect_right(ranges, d) for d in distances]
+
+def sweep_source(es: TextEvents, partitions: Dict[Tuple[str, str], TimestampDB],
+                 sweeps: Dict[Tuple[str, str], SweepCounters], cache: EventCache = None) -> None:
+    """Add the events of a source to the sweep counters of each of the partitions, parsing it once."""
+    if cache is not None:
+        cached = cache.load(es)
+        events = zip(cached.timestamps, (cached.texts[i] for i in cached.ids))
+    else:
+        events = ((ts, es.normalize(line)) for ts, line in es.get_events())
+    for chunk in chunks(events, CHUNK_SIZE):
+        times = [ts for ts, _ in chunk]
+        for key, timestamps in partitions.items():
+            sweep = sweeps[key]
+            ids = [sweep.intern(text) for _, text in chunk]
+            if not len(timestamps):
+                last = len(sweep.ranges)
+                for i in ids:
+                    sweep.add(i, last, last)
+                continue
+            nearest, period = timestamps.distances_many(times)
+            for i, n, p in zip(ids, _bucket(sweep.ranges, nearest), _bucket(sweep.ranges, period)):
+                sweep.add(i, n, p)
+
+def sweep_groups(config: eca.config.Config, ranges: List[timedelta],
+                 cache: EventCache = None) -> Tuple[Dict[Tuple[str, str], int], Dict[Tuple[str, str], SweepCounters]]:
+    """
+    Read all sources once and return the number of incidents and the sweep counters of every incident group,
+    keyed by (category, group) as from collect_group_incidents().
+    """
+    ranges_us = sorted(r // timedelta(microseconds=1) for r in ranges)
+    groups = collect_group_incidents(config, cache)
+    sweeps = {key: SweepCounters(ranges_us) for key in groups}
+    for es in config.event_sources(master=False):
+        with measured_peak(es.stats):
+            sweep_source(es, {key: timestamps for key, timestamps in groups.items() if key[0] in es.categories},
+                         sweeps, cache)
+    return {key: len(timestamps) for key, timestamps in groups.items()}, sweeps
+
+def sweep_results(incidents: Dict[Tuple[str, str], int], sweeps: Dict[Tuple[str, str], SweepCounters],
+                  percentiles: List[int], accuracies: List[int], top: int = None) -> List[dict]:
+    """
+    Return the matched texts for every incident group and combination of range, percentile and accuracy, only
+    the top with most hits of each if given.
+    """
+    results = list()
+    for (category, group), sweep in sweeps.items():
+        count = incidents[(category, group)]
+        for range_us, counters in sweep.counters():
+            within, outside = counters.columns[WITHIN], counters.columns[OUTSIDE]
+            for percentile in percentiles:
+                min_count = int((count * percentile) / 100)
+                for accuracy in accuracies:
+                    results.append({
+                        'category': category,
+                        'group': group,
+                        'range': range_us / 1000000,
+                        'percentile': percentile,
+                        'accuracy': accuracy,
+                        'incidents': count,
+                        'matches': [{'text': counters.texts[i], 'within': within[i], 'outside': outside[i]}
+                                    for i in counters.matches(min_count, accuracy, top)],
+                    })
+    return results
+
+def print_table(results: List[dict], out=sys.stdout) -> None:
+    """Print one row per grid point with the numbers of the texts it matches, followed by the texts."""
+    numbers: Dict[str, int] = dict()
+    for result in results:
+        for match in result['matches']:
+            numbers.setdefault(match['text'], len(numbers) + 1)
+
+    categories = len({result['category'] for result in results}) > 1
+    groups = any(result['group'] is not None for result in results)
+    header = f"{'category':<12}" if categories else ""
+    header += f"{'group':<12}" if groups else ""
+    print(f"{header}{'range':>8} {'percentile':>10} {'accuracy':>8} {'matches':>7}  texts", file=out)
+    for result in results:
+        row = f"{result['category']:<12}" if categories else ""
+        row += f"{result['group'] or '-':<12}" if groups else ""
+        texts = " ".join(str(numbers[match['text']]) for match in result['matches'])
+        print(f"{row}{result['range']:>7g}s {result['percentile']:>10} {result['accuracy']:>8} "
+              f"{len(result['matches']):>7}  {texts}", file=out)
+    print(file=out)
+    for text, number in numbers.items():
+        print(f"{number}: {escape(text)}", file=out)
@@ -1,19 +1,55 @@
 #!/usr/bin/env python3
 
+from bisect import bisect_left
 from datetime import datetime, timedelta
-from typing import List
+from typing import Iterable, List, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Classification of a timestamp against the incident database.
+NOT_APPLICABLE = 0
+OUTSIDE = 1
+WITHIN = 2
+
+EPOCH = datetime(1970, 1, 1)
+Timestamp = Union[datetime, int]
+
+def to_epoch(timestamp: Timestamp) -> int:
+    """Return timestamp as integer microseconds since epoch."""
+    if isinstance(timestamp, datetime):
+        return (timestamp - EPOCH) // timedelta(microseconds=1)
+    return timestamp
+
+def epoch(year: int, month: int, day: int, hours: int = 0, minutes: int = 0, seconds: int = 0,
+          microseconds: int = 0) -> int:
+    """Return microseconds since epoch for a date and time, computed in integer arithmetic only."""
+    # Days from civil date, see http://howardhinnant.github.io/date_algorithms.html
+    y = year - 1 if month <= 2 else year
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (month - 3 if month > 2 else month + 9) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    days = era * 146097 + doe - 719468
+    return (((days * 24 + hours) * 60 + minutes) * 60 + seconds) * 1000000 + microseconds
 
 class TimestampDB:
     """Database of timestamps."""
     def __init__(self, range: timedelta = timedelta(seconds=2)):
         self._range = range
-        self._timestamps: List[datetime] = list()
+        self._range_us: int = range // timedelta(microseconds=1)
+        self._timestamps: List[int] = list()
         self._prepared: bool = True
-        self._youngest: datetime = None
-        self._oldest: datetime = None
+        self._youngest: int = None
+        self._oldest: int = None
+        self._starts: List[int] = list()
+        self._ends: List[int] = list()
+        self._arrays = None
 
-    def append(self, timestamp: datetime) -> None:
-        self._timestamps.append(timestamp)
+    def append(self, timestamp: Timestamp) -> None:
+        self._timestamps.append(to_epoch(timestamp))
         self._prepared = False
 
     def _prepare(self):
@@ -21,35 +57,158 @@ class TimestampDB:
         Prepare db for being used for comparising.
 
         Its necessary to have dates sorted and also to know which is the youngest and oldest timestamps.
+        Overlapping incident zones ]ts - range, ts + range[ are merged into disjoint intervals so that
+        lookups can be done by binary search on the interval starts.
         """
-        self._timestamps = sorted(self._timestamps)
-        for ts in self._timestamps:
-            if self._youngest is None or ts > self._youngest:
-                self._youngest = ts
-            if self._oldest is None or ts < self._oldest:
-                self._oldest = ts
+        self._timestamps.sort()
+        self._starts = list()
+        self._ends = list()
+        if self._timestamps:
+            self._oldest = self._timestamps[0]
+            self._youngest = self._timestamps[-1]
+            for ts in self._timestamps:
+                start, end = ts - self._range_us, ts + self._range_us
+                # Zones are open intervals, so zones that just touch are kept apart.
+                if self._ends and start < self._ends[-1]:
+                    self._ends[-1] = end
+                else:
+                    self._starts.append(start)
+                    self._ends.append(end)
 
+        if np is not None:
+            self._arrays = (np.array(self._timestamps, dtype=np.int64),
+                            np.array(self._starts, dtype=np.int64),
+                            np.array(self._ends, dtype=np.int64))
         self._prepared = True
 
     def __iter__(self):
         if not self._prepared:
             self._prepare()
 
-        return (t for t in self._timestamps)
+        return iter(self._timestamps)
 
     def __len__(self) -> int:
         return len(self._timestamps)
 
-    def is_applicable(self, timestamp):
+    def zones(self) -> List[Tuple[int, int]]:
+        """Return the merged incident zones as sorted and disjoint open intervals (start, end) of epoch timestamps."""
+        if not self._prepared:
+            self._prepare()
+        return list(zip(self._starts, self._ends))
+
+    def is_applicable(self, timestamp: Timestamp) -> bool:
         """Return true if timestamp is applicable for comparing."""
         if not self._prepared:
             self._prepare()
-        return timestamp > (self._oldest - self._range) and timestamp < (self._youngest + self._range)
+        if not self._timestamps:
+            return False
+        timestamp = to_epoch(timestamp)
+        return self._oldest - self._range_us < timestamp < self._youngest + self._range_us
 
-    def in_range(self, timestamp: datetime) -> bool:
+    def in_range(self, timestamp: Timestamp) -> bool:
         """Returns True if timestamp is within the range of timestamps for this database."""
-        for ts in self:
-            if timestamp + self._range > ts and timestamp < ts + self._range:
-                return True
-        else:
-            return False
+        if not self._prepared:
+            self._prepare()
+        timestamp = to_epoch(timestamp)
+        i = bisect_left(self._starts, timestamp) - 1
+        return i >= 0 and timestamp < self._ends[i]
+
+    def classify(self, timestamp: Timestamp) -> int:
+        """Return one of NOT_APPLICABLE, OUTSIDE or WITHIN for timestamp."""
+        if not self.is_applicable(timestamp):
+            return NOT_APPLICABLE
+        return WITHIN if self.in_range(timestamp) else OUTSIDE
+
+    def cursor(self) -> "Cursor":
+        """Return a cursor for classifying a (mostly) sorted run of timestamps."""
+        if not self._prepared:
+            self._prepare()
+        return Cursor(self)
+
+    def classify_sorted(self, timestamps: Iterable[Timestamp]) -> List[int]:
+        """Classify a sorted run of timestamps in a single merge pass."""
+        cursor = self.cursor()
+        return [cursor.classify(ts) for ts in timestamps]
+
+    def classify_many(self, timestamps: Sequence[int]) -> List[int]:
+        """
+        Classify a chunk of epoch timestamps.
+
+        With NumPy installed the whole chunk is classified by one searchsorted() call, otherwise
+        it falls back to a merge pass with a cursor.
+        """
+        if not self._prepared:
+            self._prepare()
+        if self._arrays is None or not self._timestamps:
+            return self.classify_sorted(timestamps)
+        return self.classify_array(timestamps).tolist()
+
+    def classify_array(self, timestamps: Sequence[int]) -> "np.ndarray":
+        """Classify epoch timestamps into a NumPy array of zones, for use with NumPy only."""
+        if not self._prepared:
+            self._prepare()
+        ts = np.asarray(timestamps, dtype=np.int64)
+        if not self._timestamps:
+            return np.full(len(ts), NOT_APPLICABLE)
+        _, starts, ends = self._arrays
+        index = np.searchsorted(starts, ts, side='left') - 1
+        within = (index >= 0) & (ts < ends[np.maximum(index, 0)])
+        applicable = (ts > self._oldest - self._range_us) & (ts < self._youngest + self._range_us)
+        return np.where(applicable, np.where(within, WITHIN, OUTSIDE), NOT_APPLICABLE)
+
+    def distances_many(self, timestamps: Sequence[int]) -> Tuple[List[int], List[int]]:
+        """
+        Return, for a chunk of epoch timestamps of a non empty database, the distances to the nearest incident
+        and how far they are outside of the period from the oldest to the youngest incident, negative inside.
+
+        A timestamp is within the zones of range r when the first is below r, and applicable when the second is.
+        """
+        if not self._prepared:
+            self._prepare()
+        incidents, oldest, youngest = self._timestamps, self._oldest, self._youngest
+        if self._arrays is not None:
+            sorted_incidents = self._arrays[0]
+            ts = np.asarray(timestamps, dtype=np.int64)
+            index = np.searchsorted(sorted_incidents, ts)
+            after = sorted_incidents[np.minimum(index, len(incidents) - 1)]
+            before = sorted_incidents[np.maximum(index - 1, 0)]
+            nearest = np.minimum(np.abs(ts - after), np.abs(ts - before))
+            return nearest.tolist(), np.maximum(oldest - ts, ts - youngest).tolist()
+
+        nearest = list()
+        for ts in timestamps:
+            i = bisect_left(incidents, ts)
+            nearest.append(min(abs(ts - incidents[min(i, len(incidents) - 1)]), abs(ts - incidents[max(i - 1, 0)])))
+        return nearest, [max(oldest - ts, ts - youngest) for ts in timestamps]
+
+class Cursor:
+    """
+    Merge cursor over the incident zones of a TimestampDB.
+
+    The cursor only moves forward while timestamps are increasing, which makes classification of a sorted
+    log file a single pass over the zones. A timestamp going backwards repositions the cursor by binary search.
+    """
+    def __init__(self, db: TimestampDB):
+        self._starts = db._starts
+        self._ends = db._ends
+        self._low = db._oldest - db._range_us if len(db) else 0
+        self._high = db._youngest + db._range_us if len(db) else 0
+        self._index = 0
+        self._last = None
+
+    def classify(self, timestamp: Timestamp) -> int:
+        """Return one of NOT_APPLICABLE, OUTSIDE or WITHIN for timestamp."""
+        timestamp = to_epoch(timestamp)
+        if not self._low < timestamp < self._high:
+            return NOT_APPLICABLE
+
+        if self._last is not None and timestamp < self._last:
+            self._index = max(bisect_left(self._starts, timestamp) - 1, 0)
+        self._last = timestamp
+
+        ends = self._ends
+        i = self._index
+        while ends[i] <= timestamp:
+            i += 1
+        self._index = i
+        return WITHIN if self._starts[i] < timestamp else OUTSIDE
@@ -16,6 +16,11 @@ setup(
 #    install_requires=[
 #        'python>=3.7',
 #    ],
+    extras_require={
+        'numpy': ['numpy'],
+        'fuzzy': ['thefuzz'],
+        'zstd': ['zstandard'],
+    },
     entry_points={
         'console_scripts': [
             'eca=eca.__main__:main',
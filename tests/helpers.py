@@ -0,0 +1,23 @@
+"""Log lines, configs and counts shared by the tests."""
+from eca.analysis import collect_group_incidents, count_groups
+from eca.config import Config
+from eca.timestamp import NOT_APPLICABLE, OUTSIDE, WITHIN
+
+def line(second: int, text: str, ms: int = 0) -> str:
+    """Return a log line with a Zulu timestamp second and ms milliseconds after 2022-10-17T12:00:00Z."""
+    return f"2022-10-17T{12 + second // 3600:02}:{second // 60 % 60:02}:{second % 60:02}.{ms:03}Z {text}\n"
+
+def write_config(tmp_path, text: str) -> Config:
+    """Write the config text to tmp_path, next to the sources it names, and read it."""
+    (tmp_path / "config.yaml").write_text(text)
+    return Config(str(tmp_path / "config.yaml"))
+
+def counts(counters):
+    """Return the within, outside and not applicable counts of counters by text."""
+    return {text: (counters.columns[WITHIN][i], counters.columns[OUTSIDE][i], counters.columns[NOT_APPLICABLE][i])
+            for i, text in enumerate(counters.texts)}
+
+def batch_counts(config: Config, jobs: int = 1, cache=None):
+    """Return the counts by group key of a batch run."""
+    counters = count_groups(config, collect_group_incidents(config, cache), jobs, cache)
+    return {key: counts(group_counters) for key, group_counters in counters.items()}
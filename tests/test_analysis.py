@@ -0,0 +1,56 @@
+import eca.analysis
+import eca.counters
+from eca.config import Config
+import eca.timestamp
+from helpers import batch_counts, line, write_config
+import pytest
+
+CONFIG = """range: 2s
+sources:
+- filename: m1.log
+  master: true
+  group: odd
+- filename: m2.log
+  master: true
+  group: even
+- filename: plain.log
+- filename: sorted.log
+  sorted: true
+- filename: mmap.log
+  mmap: true
+"""
+
+def _write_sources(tmp_path) -> Config:
+    (tmp_path / "m1.log").write_text("".join(line(s, "incident") for s in (30, 31, 90, 150)))
+    (tmp_path / "m2.log").write_text("".join(line(s, "incident") for s in (60, 120, 121)))
+    for name, step in (("plain.log", 3), ("sorted.log", 2), ("mmap.log", 5)):
+        (tmp_path / name).write_text("".join(line(s, f"{name} {s % 4}") for s in range(0, 200, step)))
+    return write_config(tmp_path, CONFIG)
+
+def _count_all(tmp_path):
+    return batch_counts(_write_sources(tmp_path))
+
+def test_counts_without_numpy_equal_numpy(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    expected = _count_all(tmp_path)
+    for module in (eca.analysis, eca.timestamp, eca.counters):
+        monkeypatch.setattr(module, "np", None)
+    assert _count_all(tmp_path) == expected
+    assert set(expected) == {('main', 'odd'), ('main', 'even')}
+    assert all(any(within for within, _, _ in counts.values()) for counts in expected.values())
+
+def test_counts_in_split_ranges_equal_serial(tmp_path, monkeypatch):
+    config = _write_sources(tmp_path)
+    expected = batch_counts(config)
+    monkeypatch.setattr(eca.analysis, "SPLIT_SIZE", 256)
+    jobs = 4
+    straddling = 0
+    for es in config.event_sources(master=False):
+        data = open(es.filename, "rb").read()
+        size = max(eca.analysis.SPLIT_SIZE, -(-len(data) // jobs))
+        ranges = es.byte_ranges(size)
+        assert len(ranges) == jobs
+        # A range ends after the line that straddles start + size, not at start + size.
+        straddling += sum(data[start + size - 1] != ord("\n") for start, _ in ranges[:-1])
+    assert straddling
+    assert batch_counts(config, jobs=jobs) == expected
@@ -0,0 +1,69 @@
+from eca.cache import EventCache
+from eca.dateparser import AutoParser
+from eca.sources import TextEvents
+from helpers import batch_counts, line, write_config
+
+TIME_ONLY_CONFIG = """range: 1s
+sources:
+- filename: m.log
+  master: true
+- filename: t.log
+  date-format: "{hours:2}:{minutes:2}:{seconds:2}"
+  default-date: "2022-10-17"
+"""
+
+def _source(filename) -> TextEvents:
+    return TextEvents(str(filename), AutoParser(), master=False)
+
+def _events(cached):
+    return [(ts, cached.texts[i]) for ts, i in zip(cached.timestamps, cached.ids)]
+
+def _parsed(filename):
+    es = _source(filename)
+    return [(ts, es.normalize(text)) for ts, text in es.get_events()]
+
+def _load(cache: EventCache, filename):
+    """Return the cached events of filename and the number of lines parsed to get them."""
+    es = _source(filename)
+    events = _events(cache.load(es))
+    return events, sum(es.parser_hits().values())
+
+def test_cache_parses_only_appended_lines(tmp_path):
+    filename = tmp_path / "events.log"
+    cache = EventCache(str(tmp_path / "cache"))
+    filename.write_text("".join(line(s, f"text {s % 3}") for s in range(10)))
+    assert _load(cache, filename) == (_parsed(filename), 10)
+    assert _load(cache, filename) == (_parsed(filename), 0)
+
+    # A last line without newline is parsed but not cached, since it may still be written to.
+    with open(filename, "a") as fout:
+        fout.write("".join(line(s, "new text") for s in range(10, 15)) + line(15, "partial").rstrip("\n"))
+    assert _load(cache, filename) == (_parsed(filename), 6)
+    with open(filename, "a") as fout:
+        fout.write(" line\n" + line(16, "text 1"))
+    assert _load(cache, filename) == (_parsed(filename), 2)
+    assert _load(cache, filename) == (_parsed(filename), 0)
+
+def test_cache_parses_replaced_file_again(tmp_path):
+    filename = tmp_path / "events.log"
+    cache = EventCache(str(tmp_path / "cache"))
+    filename.write_text("".join(line(s, "old") for s in range(10)))
+    _load(cache, filename)
+    filename.write_text("".join(line(s, "replaced") for s in range(20, 32)))
+    assert _load(cache, filename) == (_parsed(filename), 12)
+
+def test_cache_continues_time_only_dates_after_midnight(tmp_path):
+    # Incidents just after the midnights before and after the lines, dated from the start of the file
+    # the line after midnight is not applicable, dated from the end of the cache within.
+    (tmp_path / "m.log").write_text("2022-10-17T00:00:01.000Z incident\n2022-10-17T23:59:59.000Z incident\n")
+    (tmp_path / "t.log").write_text("12:00:00 a\n23:59:59 b\n")
+    cache = EventCache(str(tmp_path / "cache"))
+    # Every run reads the config again, for a date parser that has not seen the lines before.
+    batch_counts(write_config(tmp_path, TIME_ONLY_CONFIG), cache=cache)
+
+    with open(tmp_path / "t.log", "a") as fout:
+        fout.write("00:00:01 c\n")
+    expected = batch_counts(write_config(tmp_path, TIME_ONLY_CONFIG))
+    assert expected[('main', None)][' c'] == (0, 0, 1)
+    assert batch_counts(write_config(tmp_path, TIME_ONLY_CONFIG), cache=cache) == expected
+    assert batch_counts(write_config(tmp_path, TIME_ONLY_CONFIG), cache=cache) == expected
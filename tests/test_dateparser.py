@@ -0,0 +1,54 @@
+from eca.dateparser import AutoParser, BracketFulltimeParser, ZuluParser, create_parser_from_str
+from eca.timestamp import epoch
+
+ZULU = "2022-10-17T12:39:31.705Z foo"
+BRACKET = "[2022-10-17 12:39:31,705] bar"
+
+def test_bracket_parser_leaves_zulu_timestamps():
+    assert BracketFulltimeParser().process(ZULU) == (None, ZULU)
+    assert BracketFulltimeParser().process("x 2022-10-17 12:39:31.705Z foo")[0] is None
+
+def test_bracket_parser():
+    assert BracketFulltimeParser().process(BRACKET) == (epoch(2022, 10, 17, 12, 39, 31, 705000), " bar")
+    assert BracketFulltimeParser().process("x [2022-10-17T12:39:31] bar") == (epoch(2022, 10, 17, 12, 39, 31, 0),
+                                                                             "x  bar")
+
+def test_auto_parser_texts_do_not_depend_on_previous_lines():
+    lines = [ZULU, BRACKET, ZULU, "2022-10-17T12:39:32Z baz", BRACKET, BRACKET, ZULU]
+    mixed = AutoParser()
+    for line in lines:
+        assert mixed.process(line) == AutoParser().process(line)
+    assert mixed.process(ZULU) == ZuluParser().process(ZULU) == (epoch(2022, 10, 17, 12, 39, 31, 705000), " foo")
+
+def test_auto_parser_hits():
+    parser = AutoParser()
+    for line in [ZULU, BRACKET, BRACKET, ZULU]:
+        parser.process(line)
+    assert parser.hits_by_parser() == {'ZuluParser': 2, 'BracketFulltimeParser': 2}
+
+def test_timezone_does_not_shift_zulu_timestamps():
+    utc = epoch(2022, 10, 17, 12, 39, 31, 705000)
+    assert create_parser_from_str('iso', timezone=2).process(ZULU) == (utc, " foo")
+    auto = create_parser_from_str('auto', timezone=2)
+    assert auto.process(ZULU) == (utc, " foo")
+    assert auto.process(BRACKET) == (utc - 2 * 3600 * 1000000, " bar")
+    assert auto.hits_by_parser() == {'ZuluParser': 1, 'BracketFulltimeParser': 1}
+
+def test_time_only_template_rolls_over_at_midnight():
+    parser = create_parser_from_str('{hours:2}:{minutes:2}:{seconds:2}', default_date='2022-10-17')
+    times = [parser.process(line)[0] for line in ["23:59:58 a", "23:59:57 b", "00:00:01 c", "18:00:00 d", "00:00:02 e"]]
+    assert times == [epoch(2022, 10, 17, 23, 59, 58, 0), epoch(2022, 10, 17, 23, 59, 57, 0),
+                     epoch(2022, 10, 18, 0, 0, 1, 0), epoch(2022, 10, 18, 18, 0, 0, 0), epoch(2022, 10, 19, 0, 0, 2, 0)]
+    parser.reset()
+    assert parser.process("00:00:01 c")[0] == epoch(2022, 10, 17, 0, 0, 1, 0)
+
+def test_dated_template_does_not_roll_over():
+    parser = create_parser_from_str('{year:4}-{month:2}-{day:2} {hours:2}:{minutes:2}:{seconds:2}')
+    parser.process("2022-10-17 23:59:58 a")
+    assert parser.process("2022-10-17 00:00:01 b")[0] == epoch(2022, 10, 17, 0, 0, 1, 0)
+
+def test_delta_template_parses_dmesg_padding():
+    parser = create_parser_from_str('[{delta}]', default_date='2022-10-17', default_time='12:00:00')
+    start = epoch(2022, 10, 17, 12, 0, 0, 0)
+    assert parser.process("[   13.380] usb 1-1: new device") == (start + 13380000, " usb 1-1: new device")
+    assert parser.process("[12345.000001] eth0: link up") == (start + 12345000001, " eth0: link up")
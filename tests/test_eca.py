@@ -0,0 +1,48 @@
+import random
+from eca.eca import ParserFactory, compare_files, match_times, read_times
+from helpers import line
+
+def _parser(overlap: float):
+    parser = ParserFactory.get_parser('iso')
+    parser.set_overlap(overlap)
+    return parser
+
+def _merge(a, b, margin_a: int, margin_b: int):
+    """Match a and b one event at a time, without skipping."""
+    i, j = 0, 0
+    coincidents, misses = 0, 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j] - margin_a:
+            misses, i = misses + 1, i + 1
+        elif b[j] < a[i] - margin_b:
+            misses, j = misses + 1, j + 1
+        else:
+            coincidents, i, j = coincidents + 1, i + 1, j + 1
+    return coincidents, misses
+
+def test_compare_files_pairs_equal_two_file_compare(tmp_path):
+    rng = random.Random(1)
+    files = list()
+    for n, count in enumerate((200, 50, 120, 5)):
+        filename = tmp_path / f"events{n}.log"
+        # Clustered events, so that both runs without matches and close matches occur.
+        times = sorted(rng.choice((0, 1800)) * 1000 + rng.randrange(600 * 1000) for _ in range(count))
+        filename.write_text("".join(line(ms // 1000, f"event {n}", ms % 1000) for ms in times) + "no time here\n")
+        files.append(str(filename))
+    overlaps = [1.0, 0.5, 2.0, 1.0]
+
+    results = compare_files(files, [_parser(overlap) for overlap in overlaps])
+    assert set(results) == {(i, j) for i in range(len(files)) for j in range(i + 1, len(files))}
+    for (i, j), result in results.items():
+        assert compare_files([files[i], files[j]], [_parser(overlaps[i]), _parser(overlaps[j])]) == {(0, 1): result}
+        a, b = read_times(files[i], _parser(overlaps[i])), read_times(files[j], _parser(overlaps[j]))
+        assert _merge(a, b, int(overlaps[i] * 1000000), int(overlaps[j] * 1000000)) == result
+    assert any(coincidents and misses for coincidents, misses in results.values())
+
+def test_match_times_equals_merge():
+    rng = random.Random(2)
+    for _ in range(50):
+        a = sorted(rng.randrange(100) for _ in range(rng.randrange(30)))
+        b = sorted(rng.randrange(100) for _ in range(rng.randrange(30)))
+        margin_a, margin_b = rng.randrange(5), rng.randrange(5)
+        assert match_times(a, b, margin_a, margin_b) == _merge(a, b, margin_a, margin_b)
@@ -0,0 +1,58 @@
+from eca.follow import Follower
+from helpers import batch_counts, counts, line, write_config
+
+CONFIG = """range: 2s
+sources:
+- filename: m.log
+  master: true
+- filename: a.log
+- filename: b.log
+"""
+
+def test_follow_with_lagging_source_counts_as_batch(tmp_path):
+    rounds = [
+        {'m.log': [10, 40], 'a.log': range(0, 100, 3), 'b.log': range(0, 20, 2)},
+        {'m.log': [70], 'a.log': range(100, 130, 3), 'b.log': range(20, 110, 2)},
+        {'m.log': [125], 'a.log': [], 'b.log': range(110, 140, 2)},
+    ]
+    follower = None
+    for appends in rounds:
+        for name, seconds in appends.items():
+            with open(tmp_path / name, "a") as fout:
+                for second in seconds:
+                    fout.write(line(second, f"{name} {'near' if second % 30 in (9, 10, 11) else 'far'}"))
+        if follower is None:
+            follower = Follower(write_config(tmp_path, CONFIG))
+        follower.poll()
+    follower.finish()
+
+    assert follower.dropped == 0
+    assert follower.analyses[('main', None)].incidents == 4
+    expected = batch_counts(write_config(tmp_path, CONFIG))
+    assert counts(follower.analyses[('main', None)].counters) == expected[('main', None)]
+
+def test_follow_idle_master_does_not_hold_back_lines(tmp_path):
+    (tmp_path / "m.log").write_text("".join(line(s, "incident") for s in (10, 40)))
+    (tmp_path / "b.log").write_text("")
+    follower = Follower(write_config(tmp_path, CONFIG), idle_polls=2)
+    for start in range(0, 200, 20):
+        with open(tmp_path / "a.log", "a") as fout:
+            fout.write("".join(line(s, f"a {'near' if s % 30 == 10 else 'far'}") for s in range(start, start + 20)))
+        follower.poll()
+        # The master and b.log are idle from the second poll, a.log is only held back for the line being read.
+        assert start < 20 or follower.held <= 1
+    follower.finish()
+    expected = batch_counts(write_config(tmp_path, CONFIG))
+    assert follower.dropped == 0
+    assert counts(follower.analyses[('main', None)].counters) == expected[('main', None)]
+
+def test_follow_holds_back_at_most_max_held_lines(tmp_path):
+    (tmp_path / "m.log").write_text(line(10, "incident"))
+    (tmp_path / "b.log").write_text("")
+    (tmp_path / "a.log").write_text("".join(line(s, "a") for s in range(200)))
+    follower = Follower(write_config(tmp_path, CONFIG), idle_polls=100, max_held=50)
+    follower.poll()
+    assert follower.held == 50
+    follower.finish()
+    expected = batch_counts(write_config(tmp_path, CONFIG))
+    assert counts(follower.analyses[('main', None)].counters) == expected[('main', None)]
@@ -0,0 +1,93 @@
+import argparse
+import csv
+from eca.__main__ import parse_arguments, positive_int, warn_ignored_metrics
+from eca.analysis import collect_group_incidents, count_groups
+from eca.output import WRITERS, rows, write_groups
+from helpers import line, write_config
+import io
+import json
+import pytest
+
+CONFIG = """range: 2s
+percentile: 0
+accuracy: 50
+sources:
+- filename: m1.log
+  master: true
+  group: odd
+- filename: m2.log
+  master: true
+  group: even
+- filename: a.log
+"""
+
+METRICS_CONFIG = """range: 2s
+sources:
+- filename: m1.log
+  master: true
+- filename: cpu.log
+  type: metric-values
+"""
+
+def _write(tmp_path, format: str, top: int = None) -> str:
+    (tmp_path / "m1.log").write_text("".join(line(s, "incident") for s in (30, 90, 150)))
+    (tmp_path / "m2.log").write_text("".join(line(s, "incident") for s in (60, 120)))
+    # Texts with the characters CSV quotes, near the incidents more often the lower their number.
+    (tmp_path / "a.log").write_text("".join(line(s, f'say "{s % 30}", then {s % 30 < 4}') for s in range(200)))
+    config = write_config(tmp_path, CONFIG)
+    groups = collect_group_incidents(config)
+    out = io.StringIO()
+    write_groups(config, {key: len(timestamps) for key, timestamps in groups.items()}, count_groups(config, groups),
+                 format, top, out=out)
+    return out.getvalue()
+
+def _write_results(results, format: str) -> str:
+    out = io.StringIO()
+    WRITERS[format](results, out=out)
+    return out.getvalue()
+
+def test_json_has_a_result_per_group(tmp_path):
+    results = json.loads(_write(tmp_path, "json"))
+    assert [(result['category'], result['group']) for result in results] == [('main', 'odd'), ('main', 'even')]
+    for result in results:
+        assert set(result) == {'category', 'group', 'range', 'percentile', 'accuracy', 'incidents', 'matches'}
+        assert result['matches']
+        assert all(set(match) == {'text', 'within', 'outside'} for match in result['matches'])
+    assert [result['incidents'] for result in results] == [3, 2]
+
+def test_jsonl_and_csv_have_a_row_per_match(tmp_path):
+    expected = list(rows(json.loads(_write(tmp_path, "json"))))
+    assert [json.loads(row) for row in _write(tmp_path, "jsonl").splitlines()] == expected
+
+    text = _write(tmp_path, "csv")
+    assert text.splitlines()[0] == "category,group,range,percentile,accuracy,incidents,text,within,outside"
+    # Texts with quotes and commas are quoted, with quotes doubled.
+    assert '" say ""0"", then True"' in text
+    assert list(csv.DictReader(io.StringIO(text))) == [{key: str(value) for key, value in row.items()}
+                                                       for row in expected]
+
+@pytest.mark.parametrize("format", ["json", "jsonl", "csv"])
+def test_top_keeps_the_first_matches(tmp_path, format):
+    results = json.loads(_write(tmp_path, "json"))
+    top = [{**result, 'matches': result['matches'][:2]} for result in results]
+    assert all(len(result['matches']) > 2 for result in results)
+    assert _write(tmp_path, format, top=2) == _write_results(top, format)
+
+def test_top_must_be_positive(monkeypatch):
+    assert positive_int("3") == 3
+    for value in ("0", "-1"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
+    monkeypatch.setattr("sys.argv", ["eca", "--top", "0", "config.yaml"])
+    with pytest.raises(SystemExit):
+        parse_arguments()
+
+def test_formats_and_modes_without_metrics_warn(tmp_path, monkeypatch, caplog):
+    (tmp_path / "m1.log").write_text(line(30, "incident"))
+    (tmp_path / "cpu.log").write_text("2022-10-17T12:00:30.000Z 0.5\n")
+    config = write_config(tmp_path, METRICS_CONFIG)
+    for arguments, warns in ((["--format", "table"], False), (["--format", "csv"], True), (["--sweep"], True)):
+        caplog.clear()
+        monkeypatch.setattr("sys.argv", ["eca", *arguments, "config.yaml"])
+        warn_ignored_metrics(config, parse_arguments())
+        assert ("metric-values sources are ignored" in caplog.text) == warns
@@ -0,0 +1,64 @@
+import math
+import random
+import shutil
+from eca.analysis import collect_group_incidents, count_groups
+from eca.config import Config
+from eca.timestamp import NOT_APPLICABLE, OUTSIDE, WITHIN
+from helpers import line
+
+# Copies of the same source in categories of their own, the sample of each is seeded with its filename.
+COPIES = 10
+
+CONFIG = """range: 2s
+{sample_rate}
+sources:
+- filename: m.log
+  master: true
+  categories: [{categories}]
+{sources}"""
+
+# Incidents an hour apart, with hundreds of KiB of lines between their zones.
+INCIDENTS = [600, 4200, 7800]
+
+def _write_sources(tmp_path) -> None:
+    rng = random.Random(1)
+    (tmp_path / "m.log").write_text("".join(line(s, "incident") for s in INCIDENTS))
+    with open(tmp_path / "sorted0.log", "w") as fout:
+        for tenths in range(0, 10 * 8000, 2):
+            # A steady text, and texts that come in bursts shorter than a sample block, which vary more between
+            # blocks. A text only in blocks that are not sampled can not be estimated.
+            burst = (tenths // 400) % 4
+            text = "steady" if rng.random() < 0.5 else f"burst {burst}" if rng.random() < 0.8 else "other"
+            fout.write(line(tenths // 10, text, tenths % 10 * 100))
+    for n in range(1, COPIES):
+        shutil.copy(tmp_path / "sorted0.log", tmp_path / f"sorted{n}.log")
+
+def _count(tmp_path, sample_rate: str, copies: int):
+    categories = ", ".join(f"c{n}" for n in range(copies))
+    sources = "".join(f"- filename: sorted{n}.log\n  sorted: true\n  categories: [c{n}]\n" for n in range(copies))
+    (tmp_path / "config.yaml").write_text(CONFIG.format(sample_rate=sample_rate, categories=categories,
+                                                        sources=sources))
+    config = Config("config.yaml")
+    return count_groups(config, collect_group_incidents(config))
+
+def test_sampled_counts_within_error(tmp_path, monkeypatch):
+    # Relative filenames, so that the samples are the same on every run.
+    monkeypatch.chdir(tmp_path)
+    _write_sources(tmp_path)
+    # The copies are the same, so the exact counts of one are those of all.
+    exact = _count(tmp_path, "", 1)[('c0', None)]
+    sampled = _count(tmp_path, "sample-rate: 0.5", COPIES)
+
+    assert not exact.variance
+    errors = list()
+    for counters in sampled.values():
+        assert counters.variance
+        for i, text in enumerate(exact.texts):
+            j = counters.texts.index(text)
+            assert counters.columns[WITHIN][j] == exact.columns[WITHIN][i]
+            assert counters.columns[NOT_APPLICABLE][j] == exact.columns[NOT_APPLICABLE][i]
+            errors.append((abs(counters.columns[OUTSIDE][j] - exact.columns[OUTSIDE][i]),
+                           1.96 * math.sqrt(counters.variance[j])))
+    # The error is a 95% confidence interval, from a sample of a few blocks somewhat less.
+    assert sum(difference <= error for difference, error in errors) >= 0.8 * len(errors)
+    assert all(difference <= 2 * error for difference, error in errors)
@@ -0,0 +1,58 @@
+from eca.analysis import collect_group_incidents, count_groups, group_results
+from eca.server import AnalysisServer
+from helpers import line, write_config
+import pytest
+
+CONFIG = """range: {range}
+percentile: 50
+accuracy: 50
+sources:
+- filename: m1.log
+  master: true
+  group: odd
+- filename: m2.log
+  master: true
+  categories: [main, db]
+- filename: a.log
+- filename: b.log
+  categories: [db]
+"""
+
+def _write_sources(tmp_path, range_: str = "2s"):
+    (tmp_path / "m1.log").write_text("".join(line(s, "incident") for s in (30, 31, 90, 150)))
+    (tmp_path / "m2.log").write_text("".join(line(s, "incident") for s in (60, 120, 121)))
+    (tmp_path / "a.log").write_text("".join(line(s, f"a {s % 30}") for s in range(0, 200)))
+    (tmp_path / "b.log").write_text("".join(line(s, f"b {s % 60}") for s in range(0, 200, 2)))
+    return write_config(tmp_path, CONFIG.format(range=range_))
+
+def _batch_results(config):
+    groups = collect_group_incidents(config)
+    return group_results(config, {key: len(timestamps) for key, timestamps in groups.items()},
+                         count_groups(config, groups))
+
+def test_query_equals_batch_results(tmp_path):
+    server = AnalysisServer(_write_sources(tmp_path))
+    expected = _batch_results(_write_sources(tmp_path))
+    assert server.query({}) == {'results': expected}
+    assert all(result['matches'] for result in expected)
+
+    ranged = _batch_results(_write_sources(tmp_path, "5s"))
+    assert server.query({'range': "5s"}) == server.query({'range': 5}) == {'results': ranged}
+    assert server.query({'categories': ["db"]}) == {'results': [r for r in expected if r['category'] == "db"]}
+
+@pytest.mark.parametrize("request_", [
+    "not an object",
+    {'unknown': 1},
+    {'range': [5]},
+    {'range': "5 seconds"},
+    {'percentile': "most"},
+    {'categories': "main"},
+    {'categories': ["nosuch"]},
+    {'sources': "a.log"},
+    {'sources': ["nosuch.log"]},
+    {'master': "a.log"},
+    {'master': ["m1.log"]},
+])
+def test_malformed_query_answers_error(tmp_path, request_):
+    answer = AnalysisServer(_write_sources(tmp_path)).respond(request_)
+    assert set(answer) == {'error'}
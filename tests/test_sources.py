@@ -0,0 +1,80 @@
+import bz2
+from eca.dateparser import AutoParser
+from eca.sources import PREFIX_SIZE, TextEvents
+import gzip
+from helpers import batch_counts, line, write_config
+import lzma
+import os
+import pytest
+
+LINES = [
+    "2022-10-17T12:39:31.705Z short",
+    "2022-10-17T12:39:32.000Z a long line " + "with many words " * 8,
+    "[2022-10-17 12:39:33,100] a long bracket line  with  double  spaces " + "x" * PREFIX_SIZE,
+    "2022-10-17T12:39:34Z " + "y" * 2 * PREFIX_SIZE,
+    "2022-10-17T12:39:35Z long line ending in spaces" + " " * PREFIX_SIZE,
+    "no timestamp in this line " * 4,
+    "   2022-10-17T12:39:36Z indented " + "z " * PREFIX_SIZE,
+]
+
+def _source(tmp_path) -> TextEvents:
+    filename = tmp_path / "events.log"
+    filename.write_text("\n".join(LINES) + "\n")
+    return TextEvents(str(filename), AutoParser(), master=False)
+
+def test_scan_events_texts_equal_get_events(tmp_path):
+    expected = list(_source(tmp_path).get_events())
+    assert list(_source(tmp_path).scan_events(lambda ts: True)) == expected
+    assert list(_source(tmp_path).scan_events(lambda ts: False)) == [(ts, None) for ts, _ in expected]
+
+def test_scan_events_parses_every_line_once(tmp_path):
+    source = _source(tmp_path)
+    list(source.scan_events(lambda ts: True))
+    assert sum(source.parser_hits().values()) == len(LINES) - 1
+    assert source.stats.misses == 1
+
+COMPRESSED_CONFIG = """range: 2s
+sources:
+- filename: m.log
+  master: true
+- filename: {filename}
+"""
+
+def _compress(name: str, data: bytes, path) -> None:
+    if name == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        path.write_bytes(zstandard.ZstdCompressor().compress(data))
+    else:
+        path.write_bytes({'gzip': gzip, 'bz2': bz2, 'xz': lzma}[name].compress(data))
+
+def _write_events(tmp_path) -> bytes:
+    (tmp_path / "m.log").write_text("".join(line(s, "incident") for s in (30, 31, 90, 150)))
+    return "".join(line(s, f"text {s % 7}") for s in range(0, 200)).encode()
+
+@pytest.mark.parametrize("compression, extension", [("gzip", ".gz"), ("bz2", ".bz2"), ("xz", ".xz"),
+                                                    ("zstd", ".zst")])
+def test_compressed_source_counts_equal_plain(tmp_path, compression, extension):
+    data = _write_events(tmp_path)
+    (tmp_path / "a.log").write_bytes(data)
+    _compress(compression, data, tmp_path / f"a.log{extension}")
+    # Without extension the compression is detected from the magic bytes.
+    _compress(compression, data, tmp_path / "b.log")
+    expected = batch_counts(write_config(tmp_path, COMPRESSED_CONFIG.format(filename="a.log")))
+    for filename in (f"a.log{extension}", "b.log"):
+        assert batch_counts(write_config(tmp_path, COMPRESSED_CONFIG.format(filename=filename))) == expected
+
+def test_globbed_rotated_source_counts_equal_plain(tmp_path):
+    data = _write_events(tmp_path)
+    (tmp_path / "a.log").write_bytes(data)
+    expected = batch_counts(write_config(tmp_path, COMPRESSED_CONFIG.format(filename="a.log")))
+
+    # Rotated parts, newest without number, some compressed, with the same modification time.
+    lines = data.splitlines(keepends=True)
+    os.mkdir(tmp_path / "logs")
+    (tmp_path / "logs" / "a.log.2.gz").write_bytes(gzip.compress(b"".join(lines[:70])))
+    (tmp_path / "logs" / "a.log.1").write_bytes(b"".join(lines[70:150]))
+    (tmp_path / "logs" / "a.log").write_bytes(b"".join(lines[150:]))
+    for path in (tmp_path / "logs").iterdir():
+        os.utime(path, ns=(0, 0))
+    for filename in ("logs/a.log*", "logs"):
+        assert batch_counts(write_config(tmp_path, COMPRESSED_CONFIG.format(filename=filename))) == expected
@@ -0,0 +1,38 @@
+from datetime import timedelta
+from eca.analysis import collect_group_incidents
+from eca.streaming import stream_sources
+from helpers import batch_counts, counts, line, write_config
+
+CONFIG = """range: 2s
+sources:
+- filename: m1.log
+  master: true
+  group: odd
+- filename: m2.log
+  master: true
+  categories: [main, db]
+- filename: a.log
+- filename: b.log
+  categories: [db]
+"""
+
+def test_streaming_counts_as_batch(tmp_path):
+    (tmp_path / "m1.log").write_text("".join(line(s, "incident") for s in (20, 21, 80)))
+    (tmp_path / "m2.log").write_text("".join(line(s, "incident") for s in (50, 110)))
+    # Every fifth pair of lines is swapped, one second out of order.
+    seconds = list(range(0, 140))
+    for i in range(0, len(seconds) - 1, 5):
+        seconds[i], seconds[i + 1] = seconds[i + 1], seconds[i]
+    (tmp_path / "a.log").write_text("".join(line(s, f"a {s % 3}") for s in seconds))
+    (tmp_path / "b.log").write_text("".join(line(s, f"b {s % 2}") for s in range(10, 130, 2)))
+    config = write_config(tmp_path, CONFIG)
+
+    analyses, dropped = stream_sources(config, timedelta(seconds=1))
+
+    groups = collect_group_incidents(config)
+    expected = batch_counts(config)
+    assert dropped == 0
+    assert set(analyses) == set(groups)
+    for key, timestamps in groups.items():
+        assert analyses[key].incidents == len(timestamps)
+        assert counts(analyses[key].counters) == expected[key]
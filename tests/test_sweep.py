@@ -0,0 +1,42 @@
+from datetime import timedelta
+from eca.cache import EventCache
+from eca.sweep import sweep_groups
+from helpers import batch_counts, counts, line, write_config
+import pytest
+
+CONFIG = """range: {range}
+sources:
+- filename: m1.log
+  master: true
+  group: odd
+- filename: m2.log
+  master: true
+  categories: [main, db]
+- filename: a.log
+- filename: b.log
+  categories: [db]
+"""
+
+RANGES = ["1s", "2.5s", "7s"]
+
+def _write_sources(tmp_path) -> None:
+    (tmp_path / "m1.log").write_text("".join(line(s, "incident") for s in (30, 31, 90, 150)))
+    (tmp_path / "m2.log").write_text("".join(line(s, "incident") for s in (60, 120, 121)))
+    (tmp_path / "a.log").write_text("".join(line(s, f"a {s % 7}", 500 * (s % 2)) for s in range(0, 200)))
+    (tmp_path / "b.log").write_text("".join(line(s, f"b {s % 11}") for s in range(0, 200, 2)))
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_sweep_counts_equal_separate_runs(tmp_path, cached):
+    _write_sources(tmp_path)
+    cache = EventCache(str(tmp_path / "cache")) if cached else None
+    incidents, sweeps = sweep_groups(write_config(tmp_path, CONFIG.format(range="1s")),
+                                     [timedelta(seconds=float(r[:-1])) for r in RANGES], cache)
+
+    runs = [batch_counts(write_config(tmp_path, CONFIG.format(range=range_))) for range_ in RANGES]
+    assert runs[0] != runs[-1]
+    assert incidents == {('main', 'odd'): 4, ('main', None): 3, ('db', None): 3}
+    for range_, expected in zip(RANGES, runs):
+        assert set(sweeps) == set(expected)
+        for key, sweep in sweeps.items():
+            swept = dict(sweep.counters())
+            assert counts(swept[int(float(range_[:-1]) * 1000000)]) == expected[key]